@@ -0,0 +1,36 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Tests for :py:mod:`toyz.web.colormaps`
+"""
+from __future__ import print_function, division
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tornado')
+from toyz.web import colormaps
+
+def get_image(width=2048, height=2048):
+    """
+    Noisy image with a few bright sources
+    """
+    rng = np.random.RandomState(42)
+    data = rng.normal(100, 10, (height, width))
+    data[rng.randint(0, height, 200), rng.randint(0, width, 200)] += 5000
+    return data
+
+def test_zscale_matches_astropy():
+    visualization = pytest.importorskip('astropy.visualization')
+    sample = colormaps.get_sample(get_image(), colormaps.ZSCALE_SAMPLES)
+    expected = visualization.ZScaleInterval(n_samples=sample.size).get_limits(sample)
+    assert np.allclose(colormaps.zscale(sample), expected)
+
+def test_zscale_bounds_time():
+    data = get_image()
+    colormaps.get_bounds(data, 'zscale')
+    start = time.time()
+    px_min, px_max = colormaps.get_bounds(data, 'zscale')
+    assert time.time()-start < .05
+    assert 0 < px_min < 100 < px_max < 1000
@@ -0,0 +1,76 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Tests for :py:mod:`toyz.web.executors`
+"""
+from __future__ import print_function, division
+import multiprocessing
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('tornado')
+from toyz.web import executors
+from toyz.web import session_vars
+
+def get_tasks(interactive_done):
+    """
+    Tasks module with a bulk task that waits for an interactive task to finish
+    """
+    tasks = types.ModuleType('test.tasks')
+    def bulk_task(toyz_settings, tid, params):
+        return {
+            'id': 'bulk',
+            'interactive_done': interactive_done.wait(10)
+        }
+    def interactive_task(toyz_settings, tid, params):
+        interactive_done.set()
+        return {'id': 'interactive'}
+    tasks.bulk_task = bulk_task
+    tasks.interactive_task = interactive_task
+    return tasks
+
+def get_job(request_id, task, priority):
+    return {
+        'job': {
+            'id': {
+                'user_id': 'admin',
+                'session_id': 'test',
+                'request_id': request_id
+            },
+            'module': 'test.tasks',
+            'task': task,
+            'parameters': {}
+        },
+        'priority': priority
+    }
+
+def test_interactive_job_runs_during_bulk_job(monkeypatch):
+    interactive_done = threading.Event()
+    monkeypatch.setattr(session_vars, 'session_process', False)
+    monkeypatch.setattr(session_vars, 'toyz_settings', None, raising=False)
+    monkeypatch.setitem(session_vars.toyz_modules, ('admin', 'test.tasks'), {
+        'module': get_tasks(interactive_done),
+        'path': None,
+        'mtime': None
+    })
+    app_pipe, session_pipe = multiprocessing.Pipe()
+    websocket_pipe = multiprocessing.Pipe()[0]
+    session = threading.Thread(target=executors.job_process,
+        args=('test', session_pipe, websocket_pipe))
+    session.start()
+    try:
+        app_pipe.send(get_job(1, 'bulk_task', 'bulk'))
+        app_pipe.send(get_job(2, 'interactive_task', 'interactive'))
+        results = []
+        for n in range(2):
+            assert app_pipe.poll(10)
+            results.append(app_pipe.recv())
+    finally:
+        app_pipe.close()
+        session.join(10)
+    # The interactive job finished while the bulk job was still running
+    assert [result['id']['request_id'] for result in results] == [2, 1]
+    assert results[1]['response']['interactive_done']
+    assert not session.is_alive()
@@ -0,0 +1,39 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Tests for :py:mod:`toyz.utils.db_interfaces.sqlite_interface`
+"""
+from __future__ import print_function, division
+import sqlite3
+
+import pytest
+
+pytest.importorskip('tornado')
+from toyz.utils.db_interfaces import sqlite_interface
+
+class DbSettings:
+    def __init__(self, path):
+        self.path = path
+
+def get_journal_mode(path):
+    db = sqlite3.connect(path)
+    journal_mode = db.execute('pragma journal_mode;').fetchone()[0]
+    db.close()
+    return journal_mode
+
+def test_new_database_uses_wal(tmpdir):
+    db_settings = DbSettings(str(tmpdir.join('toyz.db')))
+    sqlite_interface.create_toyz_database(db_settings)
+    assert get_journal_mode(db_settings.path) == 'wal'
+
+def test_existing_database_switched_to_wal(tmpdir):
+    db_settings = DbSettings(str(tmpdir.join('old.db')))
+    db = sqlite3.connect(db_settings.path)
+    db.execute('create table paths (path text);')
+    db.commit()
+    db.close()
+    assert get_journal_mode(db_settings.path) == 'delete'
+    
+    sqlite_interface.get_connection(db_settings)
+    sqlite_interface.close_connections()
+    assert get_journal_mode(db_settings.path) == 'wal'
@@ -0,0 +1,67 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Tests for :py:mod:`toyz.web.viewer`
+"""
+from __future__ import print_function, division
+from io import BytesIO
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pyfits = pytest.importorskip('astropy.io.fits')
+Image = pytest.importorskip('PIL.Image')
+pytest.importorskip('matplotlib')
+pytest.importorskip('tornado')
+from toyz.web import viewer
+
+def get_tile(filepath, resampling, scale):
+    """
+    Create a single tile covering a 64x64 FITS image and decode it
+    """
+    file_info = {
+        'filepath': filepath,
+        'ext': 'fits',
+        'resampling': resampling,
+        'tile_format': 'png',
+        'tile_transport': 'websocket'
+    }
+    img_info = {
+        'frame': 0,
+        'scale': scale,
+        'invert_x': False,
+        'invert_y': False,
+        'colormap': {
+            'name': 'gray',
+            'invert_color': False,
+            'px_min': 0,
+            'px_max': 1,
+            'color_scale': 'linear'
+        }
+    }
+    size = int(64*scale)
+    tile_info = {
+        'idx': 'tile',
+        'x0_idx': 0,
+        'xf_idx': 64,
+        'y0_idx': 0,
+        'yf_idx': 64,
+        'width': size,
+        'height': size
+    }
+    created, tile_info = viewer.create_tile(file_info, img_info, tile_info)
+    assert created
+    return np.asarray(Image.open(BytesIO(tile_info['tile_data'])).convert('L'))
+
+def test_hot_pixel_survives_bilinear(tmpdir):
+    data = np.zeros((64, 64), dtype=np.float32)
+    # A pixel on odd indices is dropped by taking every other pixel
+    data[33, 33] = 1
+    filepath = str(tmpdir.join('hot_pixel.fits'))
+    pyfits.PrimaryHDU(data).writeto(filepath)
+    try:
+        tile = get_tile(filepath, 'BILINEAR', .5)
+        assert tile.shape == (32, 32)
+        assert tile.max() > 0
+    finally:
+        viewer.close_file(filepath)
@@ -9,12 +9,15 @@ import importlib
 import imp
 import base64
 import uuid
+import copy
+import itertools
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 from collections import OrderedDict
 import multiprocessing
+import threading
 import logging
 logger = logging.getLogger("toyz.core")
 
@@ -22,6 +25,54 @@ from toyz.utils import db as db_utils
 from toyz.utils.errors import ToyzError, ToyzDbError, ToyzWebError, ToyzJobError, ToyzWarning
 from toyz.web import session_vars
 
+# Jobs received by the session process while it was busy running another job
+if not hasattr(session_vars, 'job_queue'):
+    session_vars.job_queue = []
+# Request ids of running jobs that have been cancelled by the client
+if not hasattr(session_vars, 'cancelled_jobs'):
+    session_vars.cancelled_jobs = set()
+# Modules already found by get_toyz_module, with keys (user_id, module)
+if not hasattr(session_vars, 'toyz_modules'):
+    session_vars.toyz_modules = {}
+# Module info for each user (see get_module_info)
+if not hasattr(session_vars, 'module_info'):
+    session_vars.module_info = {}
+# Groups, modules and toyz of users and groups loaded from the database 
+# (see get_user_param)
+if not hasattr(session_vars, 'user_settings'):
+    session_vars.user_settings = {}
+# Whether or not the current process is a websocket's session process 
+# (see :py:func:`toyz.web.executors.job_process` )
+if not hasattr(session_vars, 'session_process'):
+    session_vars.session_process = False
+# Tasks sent to the application's process pool by the session process, with keys task_id
+# and values ``(result, error)`` once the task has finished (see run_pool_task)
+if not hasattr(session_vars, 'pool_tasks'):
+    session_vars.pool_tasks = {}
+
+# Pipe used by the job running in the current thread. Jobs run by a thread pool in the
+# application share session_vars, so the pipe for each job is stored separately.
+_job_local = threading.local()
+
+# Held by the threads of a session process (see :py:func:`toyz.web.executors.job_process` )
+# while they change the job queue, cancelled jobs or pool results, and notified each time
+# a message from the application is received
+session_condition = threading.Condition()
+
+# Unique id for each task sent to the application's process pool by this process
+_pool_task_ids = itertools.count()
+
+# Priority classes of jobs, in the order that jobs waiting in the session's queue are run 
+# (see :py:mod:`toyz.web.executors` )
+job_priorities = ['interactive', 'bulk']
+
+# Tasks that are quick to run and change how queued jobs are handled. These are run as soon
+# as they are received (see :py:func:`toyz.utils.core.receive_jobs` ) instead of waiting 
+# for the jobs ahead of them to finish.
+priority_tasks = [
+    ('toyz.web.tasks', 'get_tile_info')
+]
+
 # Path that toyz has been installed in
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),os.pardir))
 
@@ -41,6 +92,24 @@ default_settings = {
     'web': {
         'port': 8888,
         'cookie_secret': base64.b64encode(uuid.uuid4().bytes + uuid.uuid4().bytes),
+        # Maximum size (in MB) of the tile cache shared by all sessions (0 disables it)
+        'tile_cache_size': 1024,
+        # Number of tiles each session renders at the same time in the shared process
+        # pool (None uses the number of processes in the pool)
+        'tile_processes': None,
+        # Number of processes in the pool shared by all sessions (None uses all cpus) and
+        # number of threads in the application used to run jobs
+        # (see :py:mod:`toyz.web.executors` )
+        'job_processes': None,
+        'job_threads': 4,
+        # Executors for tasks that override the defaults, for example
+        # {'toyz.web.tasks.load_directory': 'thread'}
+        'task_executors': {},
+        # Priority classes for tasks that override the defaults, for example
+        # {'toyz.web.tasks.load_directory': 'bulk'}, and the number of pool, thread and
+        # inline jobs each session can run at the same time
+        'task_priorities': {},
+        'max_session_jobs': 4,
         #'static_path': os.path.join(ROOT_DIR, 'web', 'static'),
         #'template_path': os.path.join(ROOT_DIR, 'web', 'templates'),
     },
@@ -301,6 +370,28 @@ def check_user_shortcuts(toyz_settings, user_id, shortcuts=None):
                 paths={shortcuts['user']: 'frwx'})
     return shortcuts
 
+def get_user_param(toyz_settings, param_type, **user):
+    """
+    Read a parameter (such as ``groups``, ``modules`` or ``toyz`` ) of a user or group
+    from the database, keeping a copy so that the database is only read the first time it
+    is needed. The cache is cleared whenever a users settings might have changed
+    (see :py:func:`toyz.utils.core.clear_module_cache` ).
+    
+    Parameters
+        - toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ): Toyz Settings
+        - param_type (*string* ): Parameter to load (see :py:mod:`toyz.utils.db` )
+        - user (*dict* ): Key is either **user_id** or **group_id**, value is the 
+          *user_id* or *group_id*
+    
+    Returns
+        - param: A copy of the parameter, so that the caller can modify it
+    """
+    key = (param_type,)+tuple(sorted(user.items()))
+    if key not in session_vars.user_settings:
+        session_vars.user_settings[key] = db_utils.get_param(toyz_settings.db, param_type, 
+            **user)
+    return copy.copy(session_vars.user_settings[key])
+
 def get_all_user_modules(toyz_settings, user_id):
     """
     Get all modules available for the user.
@@ -316,11 +407,11 @@ def get_all_user_modules(toyz_settings, user_id):
             - list of all toyz modules that the user has access
               to, including permissions granted by member groups
     """
-    groups = db_utils.get_param(toyz_settings.db, 'groups', user_id=user_id)
-    user_modules = db_utils.get_param(toyz_settings.db, 'modules', user_id=user_id)
+    groups = get_user_param(toyz_settings, 'groups', user_id=user_id)
+    user_modules = get_user_param(toyz_settings, 'modules', user_id=user_id)
     user_modules.extend(toyz_settings.config.approved_modules)
     for group_id in groups:
-        user_modules.extend(db_utils.get_param(toyz_settings.db, 'modules', group_id=group_id))
+        user_modules.extend(get_user_param(toyz_settings, 'modules', group_id=group_id))
     return list(set(user_modules))
 
 def check_user_modules(toyz_settings, user_id, module):
@@ -361,11 +452,11 @@ def get_all_user_toyz(toyz_settings, user_id):
             - All of the local python directories that the user can use to run
               jobs.
     """
-    groups = db_utils.get_param(toyz_settings.db, 'groups', user_id=user_id)
+    groups = get_user_param(toyz_settings, 'groups', user_id=user_id)
     user_toyz = {}
     for group_id in groups:
-        user_toyz.update(db_utils.get_param(toyz_settings.db, 'toyz', group_id=group_id))
-    user_toyz.update(db_utils.get_param(toyz_settings.db, 'toyz', user_id=user_id))
+        user_toyz.update(get_user_param(toyz_settings, 'toyz', group_id=group_id))
+    user_toyz.update(get_user_param(toyz_settings, 'toyz', user_id=user_id))
     return user_toyz
 
 def get_user_toyz(toyz_settings, user_id, toy):
@@ -382,21 +473,56 @@ def get_user_toyz(toyz_settings, user_id, toy):
     Returns
         toy ( *module* ): python module if it exists, otherwise ``None``.
     """
+    toy_path = get_user_toyz_path(toyz_settings, user_id, toy)
+    if toy_path is None:
+        return None
+    return imp.load_source(toy, toy_path)
+
+def get_user_toyz_path(toyz_settings, user_id, toy):
+    """
+    Get the path to the source file of a toy in a users toyz paths, or ``None`` if the
+    toy is not in the users toyz paths (see :py:func:`toyz.utils.core.get_user_toyz` ).
+    """
     user_toyz = get_all_user_toyz(toyz_settings, user_id)
     if toy in user_toyz:
-        return imp.load_source(toy, user_toyz[toy])
+        return user_toyz[toy]
     elif toy.endswith('.tasks') and toy[:-6] in user_toyz:
-        return imp.load_source(toy, os.path.join(user_toyz[toy[:-6]], 'tasks.py'))
+        return os.path.join(user_toyz[toy[:-6]], 'tasks.py')
     elif toy.endswith('.config') and toy[:-7] in user_toyz:
-        return imp.load_source(toy, os.path.join(user_toyz[toy[:-7]],'config.py'))
+        return os.path.join(user_toyz[toy[:-7]],'config.py')
     return None
 
+def get_mtime(path):
+    """
+    Last modification time of a file, or ``None`` if the file does not exist
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def clear_module_cache():
+    """
+    Remove all of the modules cached by :py:func:`toyz.utils.core.get_toyz_module`,
+    the module info cached by :py:func:`toyz.utils.core.get_module_info` and the user
+    settings cached by :py:func:`toyz.utils.core.get_user_param` .
+    This is called whenever a users modules, toyz or groups might have changed.
+    """
+    session_vars.toyz_modules.clear()
+    session_vars.module_info.clear()
+    session_vars.user_settings.clear()
+
 def get_toyz_module(toyz_settings, user_id, module):
     """
     Get a toyz module from either installed modules or one in a users toyz paths.
     An uninstalled toy will take precedence if it is in the toy paths as opposed to installed
     modules.
     
+    Modules are cached for each user, so the database is only checked the first time a
+    user runs a module. Toyz are loaded again if their source file is modified, and the
+    entire cache is cleared when the toyz settings or any user settings change
+    (see :py:func:`toyz.utils.core.clear_module_cache` ).
+    
     Parameters
         toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings` ):
             - Settings for the application runnning the job (may be needed to load user info 
@@ -411,13 +537,30 @@ def get_toyz_module(toyz_settings, user_id, module):
         Raises a :py:class:`toyz.utils.errors.ToyzJobError` if the module is not found
         in the users approved modules
     """
-    toyz_module = get_user_toyz(toyz_settings, user_id, module)
-    if toyz_module is not None:
-        return toyz_module
-    if toyz_module is None and check_user_modules(toyz_settings, user_id, module):
-        return importlib.import_module(module)
+    key = (user_id, module)
+    cached = session_vars.toyz_modules.get(key)
+    if cached is not None:
+        if cached['path'] is None:
+            return cached['module']
+        mtime = get_mtime(cached['path'])
+        if mtime is not None and mtime == cached['mtime']:
+            return cached['module']
+    
+    toy_path = get_user_toyz_path(toyz_settings, user_id, module)
+    if toy_path is not None:
+        mtime = get_mtime(toy_path)
+        toyz_module = imp.load_source(module, toy_path)
+    elif check_user_modules(toyz_settings, user_id, module):
+        mtime = None
+        toyz_module = importlib.import_module(module)
     else:
         raise ToyzJobError(module+" not found in " +user_id+"'s approved modules")
+    session_vars.toyz_modules[key] = {
+        'module': toyz_module,
+        'path': toy_path,
+        'mtime': mtime
+    }
+    return toyz_module
 
 def run_job(toyz_settings, pipe, job):
     """
@@ -454,16 +597,23 @@ def run_job(toyz_settings, pipe, job):
               to view the module (including *all_users*).
             - ``task`` (*str*): Name of the function called by the client
             - ``parameters`` (*dict*): Required and optional parameters passed to the function.
+            - Several jobs can be sent in a single message using a ``batch`` list in place
+              of the ``module``, ``task`` and ``parameters`` (see
+              :py:func:`toyz.utils.core.run_batch` ).
     
     Returns
         result: *dict*
             - The result is returned to the application running the job and is composed
-              of two keys: an ``id``: the job id for the completed job, and a ``response``
-              that is sent to the client.
+              of three keys: an ``id``: the job id for the completed job, a ``response``
+              that is sent to the client and ``complete=True`` (to distinguish it from
+              responses sent while the job is running).
             - The response is either an empty dictionary or one that contains (at a minimum) 
               the key **id**, which is used by the client to identify the type of response it is 
               receiving. Including the key **request_completed** with a *True* value tells the
               client that the current request has finished and may be removed from the queue.
+            - If the job changed a property of the application (see
+              :py:func:`toyz.utils.core.update_app` ) the result also contains an
+              ``update_app`` list of the properties that need to be reloaded.
     
     Example
     
@@ -513,19 +663,41 @@ def run_job(toyz_settings, pipe, job):
     
         is sent to the client.
     """
-    # TODO: Eventually a job should be added to the jobs dictionary and removed after the response has been sent
-    import traceback
     session_vars.toyz_settings = toyz_settings
     session_vars.pipe = pipe
+    _job_local.pipe = pipe
+    _job_local.tid = job['id']
+    _job_local.app_updates = []
+    if 'batch' in job:
+        response = run_batch(toyz_settings, job)
+    else:
+        response = run_task(toyz_settings, job)
+    
+    session_vars.cancelled_jobs.discard(job['id']['request_id'])
+    result = {
+        'id': job['id'],
+        'response': response,
+        'complete': True
+    }
+    if len(_job_local.app_updates)>0:
+        result['update_app'] = _job_local.app_updates
+    
+    #logging.info("sent message:%r",response['id'])
+    return result
+
+def run_task(toyz_settings, job):
+    """
+    Import the module for a job (if the user has permission to use it) and run its task.
+    Any errors are returned as an ``ERROR`` response (see 
+    :py:func:`toyz.utils.core.run_job` ).
+    """
+    import traceback
     response={}
     try:
-        try:
-            if job['module'].split('.')[-1] == 'tasks': 
-                toyz_module = get_toyz_module(toyz_settings,job['id']['user_id'],job['module'])
-            else:
-                raise ImportError()
-        except ImportError:
-            ToyzJobError(job['module']+" not found in " + 
+        if job['module'].split('.')[-1] == 'tasks': 
+            toyz_module = get_toyz_module(toyz_settings,job['id']['user_id'],job['module'])
+        else:
+            raise ToyzJobError(job['module']+" not found in " + 
                 job['id']['user_id']+"'s approved modules")
         task = getattr(toyz_module, job["task"])
         response = task(toyz_settings, job['id'], job['parameters'])
@@ -544,31 +716,293 @@ def run_job(toyz_settings, pipe, job):
         print(traceback.format_exc())
     if response != {}:
         response['request_id'] = job['id']['request_id']
-        #self.write_message(response)
+    return response
+
+def run_batch(toyz_settings, job):
+    """
+    Run a batch of jobs sent in a single message. Instead of a ``module`` and ``task`` the
+    job has a ``batch`` list of jobs (each with a ``module``, ``task`` and ``parameters``)
+    that share the batch's ``id``, and an optional ``combine`` flag. Each job in the batch
+    is checked for permission and run separately, so an error in one job does not stop the
+    rest of the batch.
     
-    result = {
-        'id': job['id'],
-        'response': response,
+    Each response has a ``batch_idx`` with the index of its job in the batch. By default
+    every response is sent to the client as soon as its job has finished, but if 
+    ``combine=True`` (or the job is run by an executor that cannot send responses until
+    the job has finished) the responses are returned together. Responses with binary 
+    data are always sent separately when the executor allows it, otherwise they are 
+    replaced by an ``ERROR`` response.
+    
+    Response
+        - id: 'batch'
+        - finished: True
+        - responses (*list* ): Responses from the jobs in the batch (empty unless the 
+          responses were combined)
+    """
+    pipe = get_job_pipe()
+    combine = job.get('combine', False) or pipe is None
+    responses = []
+    for idx, item in enumerate(job['batch']):
+        # Stop running the batch if the client has cancelled it
+        if job_cancelled(job['id']):
+            break
+        # Responses sent by the task while it is running also include the batch index
+        tid = dict(job['id'], batch_idx=idx)
+        response = run_task(toyz_settings, {
+            'id': tid,
+            'module': item['module'],
+            'task': item['task'],
+            'parameters': item.get('parameters', {})
+        })
+        if response == {}:
+            response = {'request_id': job['id']['request_id']}
+        response['batch_idx'] = idx
+        if 'binary' in response and pipe is None:
+            response = {
+                'id': 'ERROR',
+                'error': "Binary responses cannot be combined with the rest of the batch",
+                'traceback': '',
+                'request_id': job['id']['request_id'],
+                'batch_idx': idx
+            }
+        if combine and 'binary' not in response:
+            responses.append(response)
+        else:
+            send_response(job['id'], response)
+    return {
+        'id': 'batch',
+        'finished': True,
+        'responses': responses
     }
+
+def get_job_pipe():
+    """
+    Get the pipe used to send responses for the current job, or **None** if the job
+    cannot send responses before it has finished (for example a job run in the 
+    shared process pool).
+    """
+    return getattr(_job_local, 'pipe', getattr(session_vars, 'pipe', None))
+
+def update_app(attr):
+    """
+    Notify the application that one of its properties was changed by the current job
+    (for example the toyz settings were saved), so that the application reloads it when
+    the job has finished (see :py:func:`toyz.web.app.ToyzWebApp.update` ).
     
-    #logging.info("sent message:%r",response['id'])
-    return result
+    Parameters
+        - attr (*string* ): Name of the attribute that needs to be updated
+    """
+    if attr not in _job_local.app_updates:
+        _job_local.app_updates.append(attr)
+
+def load_job_settings(msg):
+    """
+    The toyz settings are only sent to a session process with a job when they have
+    changed, so the last settings received are kept in ``session_vars`` and added to
+    any job received without them. Receiving new settings also clears the module cache
+    (see :py:func:`toyz.utils.core.get_toyz_module` ).
+    """
+    if 'toyz_settings' in msg:
+        session_vars.toyz_settings = msg['toyz_settings']
+        # New settings are sent whenever the settings or user permissions change, so the
+        # modules found with the old settings might no longer be allowed
+        clear_module_cache()
+    else:
+        msg['toyz_settings'] = session_vars.toyz_settings
+    return msg
+
+def receive_jobs(pipe=None):
+    """
+    Read all of the messages waiting in a session's pipe without blocking. Jobs in
+    ``priority_tasks`` are run immediately and all other jobs are added to the
+    session's job queue. In a session process only the main thread reads the pipe
+    (see :py:class:`toyz.web.executors.SessionPipe` ), so this does nothing in the
+    threads running jobs. Messages to cancel a job (``{'cancel': request_id}`` ) remove the
+    job from the queue, or if it is already running, mark it as cancelled
+    (see :py:func:`toyz.utils.core.job_cancelled` ). Long running jobs can call this 
+    function periodically so that priority jobs are not stuck waiting for them to finish.
+    
+    Parameters
+        - pipe (*multiprocessing.Pipe*, optional): Pipe to the application. By default the
+          pipe of the current job is used
+    """
+    if pipe is None:
+        pipe = get_job_pipe()
+    while pipe is not None and pipe.poll():
+        msg = pipe.recv()
+        with session_condition:
+            if 'cancel' in msg:
+                cancel_job(pipe, msg['cancel'])
+                msg = None
+            elif 'pool_task' in msg:
+                # Results of tasks that are no longer needed (see run_pool_task) are dropped
+                if msg['pool_task'] in session_vars.pool_tasks:
+                    session_vars.pool_tasks[msg['pool_task']] = (msg['result'], msg['error'])
+                msg = None
+            else:
+                msg = load_job_settings(msg)
+                job = msg['job']
+                if (job.get('module'), job.get('task')) not in priority_tasks:
+                    session_vars.job_queue.append(msg)
+                    msg = None
+            session_condition.notify_all()
+        if msg is not None:
+            # Keep the id and any application updates from the job that is currently running
+            app_updates = getattr(_job_local, 'app_updates', [])
+            tid = getattr(_job_local, 'tid', None)
+            pipe.send(run_job(msg['toyz_settings'], pipe, job))
+            _job_local.app_updates = app_updates
+            _job_local.tid = tid
+
+def cancel_job(pipe, request_id):
+    """
+    Cancel a job in the current session. The application has already told the client 
+    that the job was cancelled, so a job removed from the queue only returns an empty 
+    response to let the application know that it will not be run.
+    """
+    for msg in session_vars.job_queue:
+        if msg['job']['id']['request_id']==request_id:
+            session_vars.job_queue.remove(msg)
+            pipe.send({
+                'id': msg['job']['id'],
+                'response': {},
+                'complete': True
+            })
+            return
+    session_vars.cancelled_jobs.add(request_id)
+
+def job_cancelled(tid):
+    """
+    Check whether or not the client has cancelled a job. Long running jobs can call this
+    periodically and stop early if it returns **True** .
+    """
+    receive_jobs()
+    return tid['request_id'] in session_vars.cancelled_jobs
+
+def get_next_job(pipe, priority=None):
+    """
+    Get the next job for a session process, blocking until one is received. Any priority
+    jobs waiting in the pipe are run first (see :py:func:`toyz.utils.core.receive_jobs` ),
+    then the oldest job in the highest priority class (see ``job_priorities`` ) is returned.
+    
+    Parameters
+        - pipe (*multiprocessing.Pipe* ): Pipe to the application
+        - priority (*string*, optional): Only return jobs in this priority class (used by
+          the threads of a session process that each run one class of jobs, see
+          :py:func:`toyz.web.executors.job_process` )
+    """
+    with session_condition:
+        while True:
+            receive_jobs(pipe)
+            queue = [msg for msg in session_vars.job_queue 
+                if priority is None or msg.get('priority', 'bulk')==priority]
+            if len(queue)>0:
+                msg = min(queue, key=lambda m: job_priorities.index(m.get('priority', 'bulk')))
+                session_vars.job_queue.remove(msg)
+                return msg
+            # Wait for the next message (if the pipe is closed this returns and the next 
+            # attempt to read raises an EOFError)
+            pipe.poll(None)
+
+def run_pool_task(func, args):
+    """
+    Run a function in the process pool shared by all sessions (see
+    :py:mod:`toyz.web.executors` ) from a job in the session process. The application
+    runs the task and sends its result back through the session's pipe.
+    
+    Parameters
+        - func (*function* ): Function to run. This must be defined at the top level of
+          a module so that it can be pickled
+        - args (*tuple* ): Arguments passed to ``func``
+    
+    Returns
+        - task_id (*int* ): Id used to get the result of the task
+          (see :py:func:`toyz.utils.core.get_pool_results` )
+    """
+    if not session_vars.session_process:
+        raise ToyzJobError("Only jobs in the session process can run pool tasks")
+    task_id = next(_pool_task_ids)
+    session_vars.pool_tasks[task_id] = None
+    get_job_pipe().send({
+        'pool_task': {
+            'task_id': task_id,
+            'func': func,
+            'args': args
+        }
+    })
+    return task_id
+
+def get_pool_results(task_ids):
+    """
+    Wait for at least one of the tasks sent with :py:func:`toyz.utils.core.run_pool_task`
+    to finish. Messages received from the application while waiting are handled as usual
+    (see :py:func:`toyz.utils.core.receive_jobs` ).
+    
+    Parameters
+        - task_ids (*list* ): Ids of the tasks to wait for
+    
+    Returns
+        - results (*dict* ): ``task_id: (result, error)`` for each task that has finished,
+          where ``error`` is **None** unless the task raised an error. Each result is only
+          returned once.
+    """
+    pipe = get_job_pipe()
+    with session_condition:
+        while True:
+            receive_jobs(pipe)
+            finished = [task_id for task_id in task_ids 
+                if session_vars.pool_tasks.get(task_id) is not None]
+            if len(finished)>0:
+                return {task_id: session_vars.pool_tasks.pop(task_id) for task_id in finished}
+            pipe.poll(None)
+
+def cancel_pool_tasks(task_ids):
+    """
+    Ignore the results of pool tasks that are no longer needed
+    """
+    with session_condition:
+        for task_id in task_ids:
+            session_vars.pool_tasks.pop(task_id, None)
+
+def send_response(tid, response):
+    """
+    Send a response to the client before the current job has finished. This is useful
+    for jobs that return several results, which can be sent as soon as each one is ready.
+    
+    Parameters
+        - tid (*dict* ): Task ID of the job (see :py:func:`toyz.utils.core.run_job` )
+        - response (*dict* ): Response sent to the client. This should contain (at a minimum)
+          the key **id** used by the client to identify the response
+    """
+    pipe = get_job_pipe()
+    if pipe is None:
+        raise ToyzJobError(
+            "Responses can only be sent before a job has finished by jobs run in the "
+            "session process")
+    response['request_id'] = tid['request_id']
+    if 'batch_idx' in tid:
+        response['batch_idx'] = tid['batch_idx']
+    pipe.send({
+        'id': tid,
+        'response': response
+    })
 
 def progress_log(msg):
     """
-    Send a notification to the client to update on the progress of a job
+    Send a notification to the client to update on the progress of the current job
+    (if the job can send responses before it has finished, see
+    :py:func:`toyz.utils.core.send_response` ).
     
     Parameters
         - msg ( *string* ): message to send to client
     """
-    from toyz.web import session_vars
     print(msg)
-    if hasattr(session_vars, 'pipe'):
-        notification = {
+    tid = getattr(_job_local, 'tid', None)
+    if get_job_pipe() is not None and tid is not None:
+        send_response(tid, {
             'id': 'notification',
             'msg': msg
-        }
-        session_vars.pipe.send(notification)
+        })
 
 class ToyzClass:
     """
@@ -731,10 +1165,37 @@ def get_workspace_permissions(toyz_settings, tid, params):
 
 def get_module_info(toyz_settings, tid, params):
     """
-    Get information about modules accessible by the current user
+    Get information about modules accessible by the current user. The module info is
+    built the first time it is needed for each user and kept until the users modules
+    change (see :py:func:`toyz.utils.core.clear_module_cache` ).
+    
+    Returns
+        - module_info (*dict* ): ``data_sources``, workspace ``tiles``, ``import_errors``
+          and ``toyz_modules`` (io modules) available to the user, and a ``benchmark``
+          with the time spent querying the database (``db_time``) and importing module
+          configs (``import_time``), which are both zero if the module info was ``cached``
+    """
+    user_id = tid['user_id']
+    if user_id in session_vars.module_info:
+        module_info = dict(session_vars.module_info[user_id])
+        module_info['benchmark'] = {
+            'cached': True,
+            'db_time': 0,
+            'import_time': 0
+        }
+        return module_info
+    module_info = build_module_info(toyz_settings, user_id)
+    session_vars.module_info[user_id] = module_info
+    return module_info
+
+def build_module_info(toyz_settings, user_id):
+    """
+    Import the config for each of a users modules and build the module info
+    (see :py:func:`toyz.utils.core.get_module_info` ).
     """
     from toyz.utils import io
     from toyz.utils import sources
+    import time
     
     toyz_modules = {
         'toyz': dict(io.io_modules)
@@ -744,7 +1205,9 @@ def get_module_info(toyz_settings, tid, params):
     }
     tiles = {}
     import_error = {}
-    modules = db_utils.get_param(toyz_settings.db, 'modules', user_id=tid['user_id'])
+    time1 = time.time()
+    modules = db_utils.get_param(toyz_settings.db, 'modules', user_id=user_id)
+    time2 = time.time()
     for module in modules:
         try:
             logger.info("importing {0}.config".format(module))
@@ -759,11 +1222,17 @@ def get_module_info(toyz_settings, tid, params):
                 data_sources[module] = config.src_types
         except ImportError:
             import_error[module] = 'could not import' + module+'.config'
+    time3 = time.time()
     return {
         'data_sources': data_sources,
         'tiles': tiles,
         'import_errors': import_error,
-        'toyz_modules': toyz_modules
+        'toyz_modules': toyz_modules,
+        'benchmark': {
+            'cached': False,
+            'db_time': time2-time1,
+            'import_time': time3-time2
+        }
     }
 
 class Toy:
@@ -785,42 +1254,3 @@ class Toy:
     
     def reload(self, module):
         reload(self.name)
-
-#TODO Currently ToyzJobQueue isn't used. If this isn't implemented later, remove
-class ToyzJobQueue:
-    """
-    An environment for a single user to run tasks.
-    
-    *No longer implemented, but may be in the future*
-    """
-    def __init__(self, queue_name, process_count):
-        self.queue_name = queue_name
-        self.processes = []
-        self.queue = multiprocessing.Queue()
-        self.initialize()
-    
-    def initialize(self):
-        print('Initializing processes')
-        for p in range(process_count):
-            process = multiprocessing.Process(
-                name=queue_name+'-'+str(p),
-                target=self.job_worker,
-                args=(self.queue,)
-            )
-            process.daemon = True
-            process.start()
-            self.processes.append(process)
-    
-    def add_job(self, job):
-        self.queue.put(job)
-    
-    def close_env(self, interrupt_jobs=False):
-        self.queue.put({'close_env': True})
-    
-    def job_worker(self, queue):
-        msg = {}
-        while 'EXIT' not in msg:
-            msg = queue.get()
-            self.run_job(msg)
-            
-        print("{0} closed".format(multiprocessing.current_process().name))
\ No newline at end of file
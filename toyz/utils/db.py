@@ -27,7 +27,9 @@ api_functions = [
     'delete_params',
     'update_all_params',
     'get_all_ids',
-    'get_path_info']
+    'get_path_info',
+    'get_all_paths',
+    'get_permissions_version']
 
 # Parameters for a Toyz User
 user_fields = ['pwd', 'groups', 'paths', 'modules', 'toyz', 'shortcuts', 'workspaces']
@@ -225,6 +227,23 @@ def get_path_info(db_settings, path):
     db_module = importlib.import_module(db_settings.interface_name)
     return db_module.get_path_info(db_settings, path)
 
+def get_all_paths(db_settings):
+    """
+    Get the permissions for all users and groups for every path in the database, in the
+    same format as :py:func:`toyz.utils.db.get_path_info` (with the path as the key).
+    """
+    db_module = importlib.import_module(db_settings.interface_name)
+    return db_module.get_all_paths(db_settings)
+
+def get_permissions_version(db_settings):
+    """
+    Get a value that changes whenever the paths, permissions or groups of users are 
+    modified (by any process), so that file permissions loaded from the database can be
+    cached until they change. Other parameters (like workspaces) do not change it.
+    """
+    db_module = importlib.import_module(db_settings.interface_name)
+    return db_module.get_permissions_version(db_settings)
+
 def get_table_names(db_settings):
     """
     Get the names of tables in the database (this can be useful when the user has
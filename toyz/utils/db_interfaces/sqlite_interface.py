@@ -10,10 +10,72 @@ import os
 import sys
 import json
 import sqlite3
+import threading
 
 from toyz.utils.errors import ToyzDbError
 from toyz.utils import db as db_utils
 
+# Number of compiled statements sqlite keeps for each connection. The queries built by
+# this module only depend on the parameter names, so most of them are reused.
+CACHED_STATEMENTS = 256
+
+# Connections opened by the current thread. Job processes are forked from the application
+# (and may be forked while a connection is open), so the connections also store the id
+# of the process that opened them.
+_local = threading.local()
+
+# Connections inherited from a parent process. They must never be used by the child, but
+# they are kept referenced so that they are not closed when they are garbage collected:
+# closing them would release the parent's locks on the database file.
+_inherited_connections = []
+
+# Tables used to check file permissions. Writing to any of them increments the 
+# ``permissions_version`` in ``db_info`` (see get_permissions_version).
+permission_tables = ['paths', 'user_group_links']
+
+########################################################
+# Connection Management
+########################################################
+
+def get_connection(db_settings):
+    """
+    Get a connection to the database for the current thread and process, opening it the
+    first time it is needed. Connections are kept open and reused by every function in this 
+    module. The database uses write-ahead logging so that readers in other processes do
+    not block (and are not blocked by) writers. The journal mode is stored in the database
+    file, so it is only changed the first time a database created before write-ahead
+    logging was used is opened.
+    
+    A connection is never shared between threads, and connections inherited from a parent
+    process are set aside in ``_inherited_connections`` (but never closed, since the
+    parent is still using them).
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        if getattr(_local, 'connections', None):
+            _inherited_connections.extend(_local.connections.values())
+        _local.pid = pid
+        _local.connections = {}
+    if db_settings.path not in _local.connections:
+        db = sqlite3.connect(db_settings.path, cached_statements=CACHED_STATEMENTS)
+        if db.execute('pragma journal_mode;').fetchone()[0] != 'wal':
+            db.execute('pragma journal_mode=wal;')
+        _local.connections[db_settings.path] = db
+    return _local.connections[db_settings.path]
+
+def close_connections():
+    """
+    Close all of the connections opened by the current thread. Connections inherited
+    from a parent process are not closed.
+    """
+    if getattr(_local, 'pid', None) == os.getpid():
+        for db in _local.connections.values():
+            db.close()
+    elif getattr(_local, 'connections', None):
+        _inherited_connections.extend(_local.connections.values())
+    _local.pid = os.getpid()
+    _local.connections = {}
+
 ########################################################
 # Database API Functions
 ########################################################
@@ -56,7 +118,34 @@ def update_param(db_settings, param_type, **params):
     """
     Update a parameter. See :py:mod:`toyz.utils.db` for more info.
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
+    # The connection is reused, so only count the changes made by this update
+    initial_changes = db.total_changes
+    with db:
+        write_param(db, param_type, **params)
+    return db.total_changes-initial_changes
+
+def update_permissions_version(db, tbl):
+    """
+    Increment the ``permissions_version`` if ``tbl`` is one of the ``permission_tables`` ,
+    as part of the transaction that changes the table.
+    """
+    if tbl not in permission_tables:
+        return
+    cursor = db.execute(
+        "update db_info set value=value+1 where key='permissions_version';")
+    if cursor.rowcount==0:
+        # Databases created before the version was added
+        from datetime import datetime
+        db.execute("insert into db_info (key, value, timestamp) "
+            "values ('permissions_version',1,?)", (datetime.now().__str__(),))
+
+def write_param(db, param_type, **params):
+    """
+    Write a parameter to the database without committing the changes, so that several 
+    writes can be made in a single transaction. Lists and dictionaries are written with
+    a single ``executemany`` .
+    """
     param_format = db_utils.param_formats[param_type]
     tbl = param_format['tbl']
     update = param_format['update']
@@ -70,9 +159,13 @@ def update_param(db_settings, param_type, **params):
     # Check to see if any parameters need to be converted to a jsons string
     # (ie dictionaries or lists)
     if 'json' in param_format:
-        if param_format['format'] == 'single' or param_format == 'list':
+        if param_format['format'] == 'single':
             for param in param_format['json']:
                 params[param] = json.dumps(params[param])
+        elif param_format['format'] == 'list':
+            # Each item in the list is stored in its own row (see get_param)
+            if param_format['get'] in param_format['json']:
+                params[update] = [json.dumps(p) for p in params[update]]
         elif param_format['format'] == 'dict':
             if param_format['get'][0] in param_format['json']:
                 params[update] = {json.dumps(p):v for p,v in params[update].items()}
@@ -96,23 +189,15 @@ def update_param(db_settings, param_type, **params):
         cols += param_format['get']
         sql = "replace into {0} ({1}) values ({2})".format(
             tbl, ','.join(cols), ','.join(['?' for i in cols]))
-        for p1, p2 in params[update].items():
-            pvalues = values + [p1,p2]
-            db.execute(sql,tuple(pvalues))
+        db.executemany(sql, [tuple(values + [p1,p2]) for p1, p2 in params[update].items()])
     elif param_format['format'] == 'list':
         cols.append(param_format['get'])
         sql = "replace into {0} ({1}) values ({2})".format(
             tbl, ','.join(cols), ','.join(['?' for i in cols]))
-        for val in params[update]:
-            lvalues = values + [val]
-            db.execute(sql,tuple(lvalues))
+        db.executemany(sql, [tuple(values + [val]) for val in params[update]])
     else:
         raise ToyzDbError("Invalid format")
-    
-    total_changes = db.total_changes
-    db.commit()
-    db.close()
-    return total_changes
+    update_permissions_version(db, tbl)
 
 def update_all_params(db_settings, param_type, **params):
     """
@@ -127,43 +212,38 @@ def update_all_params(db_settings, param_type, **params):
         # is sufficient
         return update_param(db_settings, param_type, **params)
     elif param_format['format'] == 'list':
-        param_dict = dict(params)
-        del param_dict[param_format['update']]
-        deleted = 0
-        old_dict = {p:params[p] for p in param_format['required']}
-        old_params = get_param(db_settings, param_type, **old_dict)
-        
-        # delete all of the parameters found in the database but not in the
-        # new list, then update all values in the new list
-        for p in old_params:
-            if p not in params[param_format['update']]:
-                param_dict[param_format['get']] = p
-                deleted += delete_param(db_settings, param_type, **param_dict)
-        # Total updates is the number of records deleted + the number of rows updated
-        return update_param(db_settings, param_type, **params) + deleted
+        key = param_format['get']
     elif param_format['format'] == 'dict':
-        param_dict = dict(params)
-        del param_dict[param_format['update']]
-        deleted = 0
-        old_dict = {p:params[p] for p in param_format['required']} 
-        old_params = get_param(db_settings, param_type, **old_dict)
-        
-        # delete all of the parameters found in the database but not in the
-        # new dict, then update all values in the new dict
-        for p in old_params:
-            if p not in params[param_format['update']]:
-                param_dict[param_format['get'][0]] = p
-                deleted += delete_param(db_settings, param_type, **param_dict)
-        # Total updates is the number of records deleted + the number of rows updated
-        return update_param(db_settings, param_type, **params) + deleted
+        key = param_format['get'][0]
     else:
         raise ToyzDbError("Invalid format")
+    
+    param_dict = dict(params)
+    del param_dict[param_format['update']]
+    old_dict = {p:params[p] for p in param_format['required']}
+    old_params = get_param(db_settings, param_type, **old_dict)
+    # Parameters found in the database but not in the new list (or dict)
+    deleted = [p for p in old_params if p not in params[param_format['update']]]
+    
+    # Delete all of the old parameters, then update all values in the new list (or dict)
+    # in a single transaction
+    db = get_connection(db_settings)
+    initial_changes = db.total_changes
+    with db:
+        if len(deleted)>0:
+            cols = list(param_dict.keys())
+            sql = "delete from {0} where {1}=?;".format(tbl, '=? and '.join(cols+[key]))
+            db.executemany(sql, [tuple([param_dict[col] for col in cols]+[p]) 
+                for p in deleted])
+        write_param(db, param_type, **params)
+    # Total updates is the number of records deleted + the number of rows updated
+    return db.total_changes-initial_changes
 
 def get_param(db_settings, param_type, wildcards=False, **params):
     """
     Get a parameter from the database. See :py:mod:`toyz.utils.db` for more info.
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     param_format = db_utils.param_formats[param_type]
     check_user_type(param_type, params)
     if param_format['format'] == 'single' or param_format['format'] == 'list':
@@ -190,7 +270,6 @@ def get_param(db_settings, param_type, wildcards=False, **params):
         sql = "select {0} from {1} where {2};".format(select, tbl, condition)
     cursor = db.execute(sql, tuple(values))
     results = cursor.fetchall()
-    db.close()
     if param_format['format'] == 'single':
         if 'json' in param_format:
             return json.loads(results[0][0])
@@ -215,7 +294,7 @@ def delete_param(db_settings, param_type, wildcards=False, **params):
     Delete a parameter entry from the database.
     See :py:mod:`toyz.utils.db` for more info.
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     check_user_type(param_type, params)
     param_format = db_utils.param_formats[param_type]
     tbl = param_format['tbl']
@@ -231,12 +310,11 @@ def delete_param(db_settings, param_type, wildcards=False, **params):
         condition = '=? and '.join(condition)
         condition += '=?'
     sql = "delete from {0} where {1};".format(tbl, condition)
-    db.execute(sql, tuple(values))
-    
-    total_changes = db.total_changes
-    db.commit()
-    db.close()
-    return total_changes
+    initial_changes = db.total_changes
+    with db:
+        db.execute(sql, tuple(values))
+        update_permissions_version(db, tbl)
+    return db.total_changes-initial_changes
 
 def create_toyz_database(db_settings):
     """
@@ -254,6 +332,7 @@ def create_toyz_database(db_settings):
                 "Toyz instance (it may be a good idea to copy your current DB before)"
                 "you proceed. Are you sure you want to overwrite the current DB? ")
         if overwrite:
+            close_connections()
             os.remove(db_settings.path)
         else:
             return
@@ -270,6 +349,8 @@ def create_toyz_database(db_settings):
         (version.version, timestamp))
     db.execute("insert into db_info (key, value, timestamp) values ('current',?,?)",
         (version.version, timestamp))
+    db.execute("insert into db_info (key, value, timestamp) "
+        "values ('permissions_version',0,?)", (timestamp,))
     
     # Create the rest of the tables for the database
     db.execute("create table users ("
@@ -330,6 +411,10 @@ def create_toyz_database(db_settings):
         (user_id, work_id, share_id, share_id_type);""")
     
     db.commit()
+    # Write-ahead logging is stored in the database file, so it only has to be set once.
+    # The journal mode cannot be changed inside a transaction, so this is done after
+    # the tables have been committed.
+    db.execute('pragma journal_mode=wal;')
     db.close()
     print("New toyz database created at '{0}'".format(db_settings.path))
 
@@ -339,10 +424,9 @@ def get_all_ids(db_settings, user_type):
     
     See :py:mod:`toyz.utils.db` for more info.
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     users = db.execute('select user_id from users where user_type=?;', (user_type,))
     users = users.fetchall()
-    db.close()
     return [u[0] for u in users]
 
 def get_path_info(db_settings, path):
@@ -351,7 +435,7 @@ def get_path_info(db_settings, path):
     
     See :py:mod:`toyz.utils.db` for more info.
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     cursor = db.execute('select user_id, permissions, user_type from paths where path=?', (path,))
     all_info = cursor.fetchall()
     if len(all_info) == 0:
@@ -360,6 +444,37 @@ def get_path_info(db_settings, path):
     group_info = {p[0]:p[1] for p in all_info if p[2]=='group_id'}
     return {'users': user_info, 'groups':group_info}
 
+def get_all_paths(db_settings):
+    """
+    Get the users and permissions for every path in the database.
+    
+    See :py:mod:`toyz.utils.db` for more info.
+    """
+    db = get_connection(db_settings)
+    cursor = db.execute('select path, user_id, permissions, user_type from paths;')
+    paths = {}
+    for path, user_id, permissions, user_type in cursor.fetchall():
+        if path not in paths:
+            paths[path] = {'users': {}, 'groups': {}}
+        if user_type == 'user_id':
+            paths[path]['users'][user_id] = permissions
+        elif user_type == 'group_id':
+            paths[path]['groups'][user_id] = permissions
+    return paths
+
+def get_permissions_version(db_settings):
+    """
+    Get the number of times the ``permission_tables`` have been changed.
+    
+    See :py:mod:`toyz.utils.db` for more info.
+    """
+    db = get_connection(db_settings)
+    row = db.execute(
+        "select value from db_info where key='permissions_version';").fetchone()
+    if row is None:
+        return 0
+    return int(row[0])
+
 def get_table_names(db_settings):
     """
     Get a list of all tables in the database.
@@ -371,10 +486,9 @@ def get_table_names(db_settings):
         tables (*list*): List of table names in the current database
     """
     try:
-        db = sqlite3.connect(db_settings.path)
+        db = get_connection(db_settings)
         tables = db.execute("select name from sqlite_master where type='table';")
         tables = tables.fetchall()
-        db.close()
     except:
         raise ToyzDbError('Error loading table names from database: {0}'.format(db_settings.path))
     return tables
@@ -384,7 +498,7 @@ def get_db_info(db_settings):
     Get db_info for the database (includes the Toyz version that created the DB, any
     updates made, and the current version of Toyz that the DB is configured for)
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     cursor = db.execute('select key, value, timestamp from db_info;')
     meta = cursor.fetchall()
     db_info = {info[0]:{
@@ -419,7 +533,7 @@ def get_workspace_sharing(db_settings, **kwargs):
     """
     Get shared workspace information
     """
-    db = sqlite3.connect(db_settings.path)
+    db = get_connection(db_settings)
     keys = kwargs.keys()
     query = ' and '.join([key+'=?' for key in keys])
     sql = 'select * from shared_workspaces where ({0});'.format(query)
@@ -437,28 +551,26 @@ def update_workspace(db_settings, user_id, work_id, update_all=True, **kwargs):
     """
     Update sharing for a workspace
     """
-    db = sqlite3.connect(db_settings.path)
-    if update_all is True:
-        sql = "delete from 'shared_workspaces' where user_id=? and work_id=?;"
-        db.execute(sql, (user_id, work_id))
-    if 'shared_users' in kwargs:
-        for row in kwargs['shared_users']:
-            row['share_id_type'] = 'user_id'
-            insert_ws_row(db, user_id, work_id, row)
-    if 'shared_groups' in kwargs:
-        for row in kwargs['shared_groups']:
-            row['share_id_type'] = 'group_id'
-            insert_ws_row(db, user_id, work_id, row)
-    db.commit()
-    db.close()
+    db = get_connection(db_settings)
+    with db:
+        if update_all is True:
+            sql = "delete from 'shared_workspaces' where user_id=? and work_id=?;"
+            db.execute(sql, (user_id, work_id))
+        if 'shared_users' in kwargs:
+            for row in kwargs['shared_users']:
+                row['share_id_type'] = 'user_id'
+                insert_ws_row(db, user_id, work_id, row)
+        if 'shared_groups' in kwargs:
+            for row in kwargs['shared_groups']:
+                row['share_id_type'] = 'group_id'
+                insert_ws_row(db, user_id, work_id, row)
 
 def delete_workspace(db_settings, user_id, work_id):
-    db = sqlite3.connect(db_settings.path)
-    # Delete shared workspace permissions
-    sql = "delete from shared_workspaces where user_id=? and work_id=?;"
-    db.execute(sql, (user_id, work_id))
-    # Delete workspace
-    sql = "delete from workspaces where user_id=? and work_id=? and user_type='user_id';"
-    db.execute(sql, (user_id, work_id))
-    db.commit()
-    db.close()
\ No newline at end of file
+    db = get_connection(db_settings)
+    with db:
+        # Delete shared workspace permissions
+        sql = "delete from shared_workspaces where user_id=? and work_id=?;"
+        db.execute(sql, (user_id, work_id))
+        # Delete workspace
+        sql = "delete from workspaces where user_id=? and work_id=? and user_type='user_id';"
+        db.execute(sql, (user_id, work_id))
\ No newline at end of file
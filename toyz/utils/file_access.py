@@ -7,12 +7,26 @@ Utilities to access path and file permissions for the server.
 from __future__ import print_function, division
 import os
 import importlib
+import threading
 from collections import OrderedDict
 
 from toyz.utils import core
 from toyz.utils import db as db_utils
 from toyz.utils.errors import ToyzError
 
+# os.scandir was added in python 3.5, older versions can use the scandir package
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Permission indices for each database used by the current thread
+# (see :py:func:`toyz.utils.file_access.get_permission_index` )
+_permission_indices = threading.local()
+
 def split_path(path_in):
     """
     Splits a path into a list of its folders. 
@@ -62,32 +76,56 @@ def get_path_tree(path):
         tree.append(path)
     return tree
 
-def get_file_permissions(db_settings, path, **user):
+def get_permission_index(db_settings):
     """
-    Get all of the permissions for a given path. Returns **None** type if no permissions have
-    been set.
+    Get the permissions of every path in the database and the groups of each user that has
+    checked permissions, loading the paths the first time they are needed. The index is 
+    kept for each thread and reloaded whenever the paths or groups in the database change
+    (see :py:func:`toyz.utils.db.get_permissions_version` ), so checking a path only
+    requires dictionary lookups.
     
-    Parameters
-        - db_settings (*object* ): Database settings
-        - path (*string* ): Path to check for permissions
-        - user (*dict* ):  Key is either **user_id** or **group_id**, value is the *user_id* or 
-          *group_id*
-    
-    Return
-        - permissions (*string* ): Permissions for the given user for the given path.
-          Returns **None** if no permissions have been set.
+    Returns
+        - index (*dict* ): ``paths``, with the same format as 
+          :py:func:`toyz.utils.db.get_all_paths`, and ``groups``, the groups for each
+          user_id already loaded
+    """
+    version = db_utils.get_permissions_version(db_settings)
+    indices = getattr(_permission_indices, 'indices', None)
+    if indices is None:
+        indices = _permission_indices.indices = {}
+    index = indices.get(db_settings.path)
+    if index is None or index['version'] != version:
+        index = indices[db_settings.path] = {
+            'version': version,
+            'paths': db_utils.get_all_paths(db_settings),
+            'groups': {}
+        }
+    return index
+
+def get_user_groups(db_settings, index, user_id):
+    """
+    Get the groups of a user from the permission index (see 
+    :py:func:`toyz.utils.file_access.get_permission_index` ).
+    """
+    if user_id not in index['groups']:
+        index['groups'][user_id] = db_utils.get_param(db_settings, 'groups', user_id=user_id)
+    return index['groups'][user_id]
+
+def get_indexed_permissions(db_settings, index, path, **user):
+    """
+    Get the permissions for a path from the permission index (see
+    :py:func:`toyz.utils.file_access.get_file_permissions` ).
     """
     # If the user is an admin, automatically grant him/her full permission
     for user_type, user_id in user.items():
         if user_id == 'admin':
             return 'frwx'
         elif 'user_id' in user:
-            groups = db_utils.get_param(db_settings, 'groups', **user)
-            print('groups', groups)
+            groups = get_user_groups(db_settings, index, user['user_id'])
             if 'admin' in groups:
                 return 'frwx'
     permissions = None
-    path_info = db_utils.get_path_info(db_settings, path)
+    path_info = index['paths'].get(path)
     
     if path_info is not None:
         # Find permissions for the user or group (if there are any)
@@ -96,7 +134,6 @@ def get_file_permissions(db_settings, path, **user):
             # Otherwise check for the most stringent group permissions
             if user['user_id'] in path_info['users']:
                 permissions = path_info['users'][user['user_id']]
-                print('permissions in user', permissions)
             else:
                 # Combine all group permissions to take the most permissive
                 # permissions of the combined groups
@@ -108,6 +145,24 @@ def get_file_permissions(db_settings, path, **user):
                 permissions = path_info['groups'][user['group_id']]
     return permissions
 
+def get_file_permissions(db_settings, path, **user):
+    """
+    Get all of the permissions for a given path. Returns **None** type if no permissions have
+    been set.
+    
+    Parameters
+        - db_settings (*object* ): Database settings
+        - path (*string* ): Path to check for permissions
+        - user (*dict* ):  Key is either **user_id** or **group_id**, value is the *user_id* or 
+          *group_id*
+    
+    Return
+        - permissions (*string* ): Permissions for the given user for the given path.
+          Returns **None** if no permissions have been set.
+    """
+    index = get_permission_index(db_settings)
+    return get_indexed_permissions(db_settings, index, path, **user)
+
 def get_parent_permissions(db_settings, path, **user):
     """
     Find the permissions of the given path. If it doesn't have any permissions
@@ -124,6 +179,7 @@ def get_parent_permissions(db_settings, path, **user):
         - permissions (*string* ): Permissions for the given user for the given path.
           Returns **None** if no permissions have been set for any parent paths.
     """
+    index = get_permission_index(db_settings)
     parents = get_all_parents(path)
     # Sometimes the `path` will really be a path and filename, so the first parent is
     # the actual path. This makes sure that we always check for the path as well as 
@@ -131,11 +187,54 @@ def get_parent_permissions(db_settings, path, **user):
     if parents[0] != path:
         parents.insert(0,path)
     for parent in parents:
-        print('parent', parent)
-        permissions = get_file_permissions(db_settings, parent, **user)
-        print('permissions', permissions)
+        permissions = get_indexed_permissions(db_settings, index, parent, **user)
         #print('permissions for {0}: {1}'.format(path,permissions))
         if permissions != None:
             return permissions
     print('No permissions for {0}'.format(path))
-    return None
\ No newline at end of file
+    return None
+
+def get_directory_permissions(db_settings, path, names, **user):
+    """
+    Find the permissions of every file or folder in a directory at once. This gives the
+    same result as calling :py:func:`toyz.utils.file_access.get_parent_permissions` for
+    each one, but the parents of the directory are only searched once.
+    
+    Parameters
+        - db_settings (*object* ): Database settings
+        - path (*string* ): Directory containing the files and folders
+        - names (*list* of strings): Names of the files and folders in ``path``
+        - user (*dict* ):  Key is either **user_id** or **group_id**, value is the *user_id* or 
+          *group_id*
+    
+    Return
+        - permissions (*dict* ): Permissions of each name in ``names`` (**None** if no
+          permissions have been set for the file or any of its parents)
+    """
+    index = get_permission_index(db_settings)
+    directory = core.normalize_path(path)
+    parent_permissions = None
+    for parent in [directory]+get_all_parents(directory):
+        parent_permissions = get_indexed_permissions(db_settings, index, parent, **user)
+        if parent_permissions != None:
+            break
+    permissions = {}
+    for name in names:
+        permissions[name] = get_indexed_permissions(db_settings, index, 
+            os.path.join(path, name), **user)
+        if permissions[name] == None:
+            permissions[name] = parent_permissions
+    return permissions
+
+def scan_directory(path):
+    """
+    List the contents of a directory, using ``scandir`` (when available) so that the type
+    of each entry is known without checking each file separately.
+    
+    Returns
+        - entries (*list* ): ``(name, is_file, is_dir)`` for each entry in the directory
+    """
+    if scandir is None:
+        return [(name, os.path.isfile(os.path.join(path, name)), 
+            os.path.isdir(os.path.join(path, name))) for name in os.listdir(path)]
+    return [(entry.name, entry.is_file(), entry.is_dir()) for entry in scandir(path)]
@@ -11,7 +11,6 @@ import os.path
 import shutil
 import importlib
 import socket
-import multiprocessing
 
 import tornado.ioloop
 import tornado.options
@@ -26,6 +25,8 @@ from toyz.utils import file_access
 from toyz.utils import third_party
 import toyz.utils.db as db_utils
 from toyz.utils.errors import ToyzError, ToyzWebError
+from toyz.web.executors import ToyzExecutors
+import toyz.web.encoding as encodings
 
 class ToyzHandler:
     """
@@ -289,23 +290,6 @@ class AuthToyz3rdPartyHandler(AuthHandler, Toyz3rdPartyHandler):
     def get(self, path):
         Toyz3rdPartyHandler.get(self, path)
 
-def job_process(session_id, pipe, websocket_pipe):
-    """
-    Process created for the websocket. When a job is received from the Toyz
-    Application it is run in this process and a response is sent.
-    """
-    websocket_pipe.close()
-    while True:
-        try:
-            msg = pipe.recv()    # Read from the output pipe and do nothing
-            job = msg['job']
-            toyz_settings = msg['toyz_settings']
-            result = core.run_job(toyz_settings, pipe, job)
-            pipe.send(result)
-        except EOFError:
-            break
-    print('job_process {0} finished'.format(session_id))
-
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     """
     Websocket that handles jobs sent to the server from clients
@@ -313,11 +297,14 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
     
     def open(self, session_id=None):
         """
-        Called when a new websocket is opened
+        Called when a new websocket is opened. The client can request an ``encoding``
+        for the session's messages in the query string of the url
+        (see :py:mod:`toyz.web.encoding` ).
         
         Parameters
             *args: Currently no arguments are passed to this function
         """
+        self.encoding = encodings.negotiate(self.get_argument('encoding', 'json'))
         settings = {
             'websocket': self,
         }
@@ -349,7 +336,7 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
         
         """
         #logging.info("message recieved: %r",message)
-        decoded = tornado.escape.json_decode(message)
+        decoded = encodings.decode(message, self.encoding)
         user_id = decoded['id']['user_id']
         if user_id !=self.session['user_id']:
             self.write_message({
@@ -358,18 +345,50 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
                 'traceback':''
             })
         session_id = decoded['id']['session_id']
-        self.job_pipe.send({
-            'job': decoded,
-            'toyz_settings': self.application.toyz_settings
-        })
+        if 'cancel' in decoded:
+            self.application.executors.cancel(self, decoded['cancel'])
+        else:
+            self.application.executors.submit(self, decoded)
     
     def send_response(self, remote_pipe, events, error=None):
         if events & tornado.ioloop.IOLoop.READ:
             result = remote_pipe.recv()
             #print("Result:", result)
-            self.write_message(result['response'])
+            if 'pool_task' in result:
+                # The session process is using the shared process pool
+                self.application.executors.run_session_task(self, result['pool_task'])
+            else:
+                self.send_result(result)
         elif events & tornado.ioloop.IOLoop.ERROR:
             print("ERROR: ", error)    
+    
+    def send_result(self, result):
+        """
+        Send the result of a job (see :py:func:`toyz.utils.core.run_job` ) to the client,
+        unless the websocket was closed or the job was cancelled while it was running.
+        If the job changed any properties of the application they are reloaded first.
+        """
+        for attr in result.get('update_app', []):
+            self.application.update(attr)
+        send = self.application.executors.receive_result(self, result)
+        if self.ws_connection is None or not send:
+            return
+        self.write_response(result['response'])
+
+    def write_response(self, response):
+        """
+        Send a response to the client. If the response contains a ``binary`` key (for
+        example an image tile encoded in memory) the rest of the response is sent first
+        with ``binary=True``, immediately followed by the binary data in its own message.
+        The response is encoded with the session's encoding (see 
+        :py:mod:`toyz.web.encoding` ).
+        """
+        binary = response.pop('binary', None)
+        if binary is not None:
+            response['binary'] = True
+        self.write_message(*encodings.encode(response, self.encoding))
+        if binary is not None:
+            self.write_message(binary, binary=True)
 
 class MainHandler(ToyzHandler, tornado.web.RequestHandler):
     """
@@ -446,6 +465,9 @@ class ToyzWebApp(tornado.web.Application):
             benchmark_handler = ToyzBenchmarkHandler
         
         self.user_sessions = {}
+        # Shortcuts of each user with an open session (see get_user_shortcuts)
+        self.user_shortcuts = {}
+        self.executors = ToyzExecutors(self.toyz_settings)
         
         if platform.system() == 'Windows':
             file_path = os.path.splitdrive(core.ROOT_DIR)
@@ -506,9 +528,7 @@ class ToyzWebApp(tornado.web.Application):
             session_id = str(
                 datetime.datetime.now()).replace(' ','__').replace('.','-').replace(':','_')
         self.user_sessions[user_id][session_id] = websocket
-        shortcuts = db_utils.get_param(self.toyz_settings.db, 'shortcuts', 
-            user_id=user_id)
-        shortcuts = core.check_user_shortcuts(self.toyz_settings, user_id, shortcuts)
+        shortcuts = self.get_user_shortcuts(user_id)
         websocket.session = {
             'user_id': user_id,
             'session_id': session_id,
@@ -516,22 +536,32 @@ class ToyzWebApp(tornado.web.Application):
         }
         core.create_paths(websocket.session['path'])
         
-        #initialize process for session jobs
-        websocket.job_pipe, remote_pipe = multiprocessing.Pipe()
-        websocket.process = multiprocessing.Process(
-            target = job_process, args=(session_id, remote_pipe, websocket.job_pipe))
-        websocket.process.start()
-        remote_pipe.close()
-        process_events = (tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
-        tornado.ioloop.IOLoop.current().add_handler(
-            websocket.job_pipe, websocket.send_response, process_events)
+        # The processes for session jobs are only started when the session runs its first
+        # job that needs them (see :py:class:`toyz.web.executors.ToyzExecutors` )
+        self.executors.init_session(websocket)
         
         websocket.write_message({
             'id': 'initialize',
             'user_id': user_id,
             'session_id': session_id,
+            'encoding': websocket.encoding
         })
     
+    def get_user_shortcuts(self, user_id):
+        """
+        Get the shortcuts for a user, checking that the user has all of the default 
+        shortcuts (see :py:func:`toyz.utils.core.check_user_shortcuts` ) the first time
+        they are loaded. Shortcuts are kept until a job changes the user settings
+        (see :py:meth:`toyz.web.app.ToyzWebApp.update` ), so opening a websocket does
+        not need to wait for the database.
+        """
+        if user_id not in self.user_shortcuts:
+            shortcuts = db_utils.get_param(self.toyz_settings.db, 'shortcuts', 
+                user_id=user_id)
+            self.user_shortcuts[user_id] = core.check_user_shortcuts(
+                self.toyz_settings, user_id, shortcuts)
+        return self.user_shortcuts[user_id]
+    
     def close_session(self, session):
         """
         Close a websocket session and delete any temporary files or directories
@@ -541,15 +571,13 @@ class ToyzWebApp(tornado.web.Application):
         """
         shutil.rmtree(session['path'])
         # Close process for current session
-        tornado.ioloop.IOLoop.current().remove_handler(
-            self.user_sessions[session['user_id']][session['session_id']].job_pipe)
-        self.user_sessions[session['user_id']][session['session_id']].job_pipe.close()
+        self.executors.close_session(
+            self.user_sessions[session['user_id']][session['session_id']])
         # Delete the current session
         del self.user_sessions[session['user_id']][session['session_id']]
         # If all of the users sessions have completed, delete the users temp directory
         if len(self.user_sessions[session['user_id']])==0:
-            shortcuts = db_utils.get_param(self.toyz_settings.db, 'shortcuts', 
-                user_id=session['user_id'])
+            shortcuts = self.get_user_shortcuts(session['user_id'])
             shutil.rmtree(shortcuts['temp'])
             del self.user_sessions[session['user_id']]
         #print('active users remaining:', self.user_sessions.keys())
@@ -563,10 +591,19 @@ class ToyzWebApp(tornado.web.Application):
         
         Parameters
             - attr (*string* ): Name of attribute that needs to be updated. So far 
-              only **toyz_settings** is supported
+              **toyz_settings** and **user_settings** (the settings of a user or group 
+              were changed) are supported
         """
         if attr == 'toyz_settings':
+            port = self.toyz_settings.web.port
             self.toyz_settings = core.ToyzSettings(self.toyz_settings.root_path)
+            # The application is still running on the same port
+            self.toyz_settings.web.port = port
+        # Job processes clear their module caches when they receive the new settings
+        core.clear_module_cache()
+        self.user_shortcuts = {}
+        self.executors.update_settings(self.toyz_settings, 
+            reload_pool=(attr == 'toyz_settings'))
 
 def init_web_app():
     """
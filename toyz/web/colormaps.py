@@ -0,0 +1,222 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Map image data to colors using precomputed colormap lookup tables.
+
+Rather than building an RGBA array of floats for every tile, the data is normalized to
+integer indices and the colors are read from a cached lookup table of uint8 RGBA values.
+"""
+from __future__ import print_function, division
+import math
+import numpy as np
+
+from toyz.utils.errors import ToyzJobError
+
+# Default number of colors in a lookup table (the same resolution as matplotlib colormaps)
+LUT_SIZE = 256
+
+# Lookup tables that have already been built in the current process
+_luts = {}
+
+def get_lut(name, invert_color=False, lut_size=LUT_SIZE):
+    """
+    Get the lookup table for a matplotlib colormap.
+
+    Parameters
+        - name (*string* ): Name of the matplotlib colormap
+        - invert_color (*bool*, optional): Whether or not to use the reversed colormap
+        - lut_size (*int*, optional): Number of colors in the table
+
+    Returns
+        - lut (*numpy array* ): ``(lut_size, 4)`` array of uint8 RGBA colors
+        - bad_color (*numpy array* ): uint8 RGBA color used for bad (NaN) pixels
+    """
+    key = (name, bool(invert_color), lut_size)
+    if key not in _luts:
+        try:
+            from matplotlib import cm as cmap
+        except ImportError:
+            raise ToyzJobError("You must have matplotlib installed to load FITS images")
+        colormap_name = name
+        if invert_color:
+            colormap_name = colormap_name + '_r'
+        if not hasattr(cmap, colormap_name):
+            raise ToyzJobError("Unrecognized colormap '{0}'".format(colormap_name))
+        colormap = getattr(cmap, colormap_name)
+        _luts[key] = (
+            colormap(np.linspace(0, 1, lut_size), bytes=True),
+            colormap(np.array([np.nan]), bytes=True)[0]
+        )
+    return _luts[key]
+
+def get_lut_indices(data, colormap, lut_size=LUT_SIZE):
+    """
+    Normalize the data and convert it into indices of a lookup table.
+
+    Parameters
+        - data (*numpy array* ): Image data
+        - colormap (*dict* ): Colormap settings for the image. This uses the keys
+          ``px_min``, ``px_max`` and ``color_scale`` (either ``'linear'`` or ``'log'``, with
+          the same scaling used by the colormaps in the web client).
+        - lut_size (*int*, optional): Number of colors in the lookup table
+
+    Returns
+        - indices (*numpy array* ): uint8 (or uint16 for tables with more than 256 colors)
+          array of indices with the same shape as ``data``
+        - bad_pixels (*numpy array* ): Boolean mask of NaN pixels
+    """
+    px_min = colormap['px_min']
+    px_max = colormap['px_max']
+    color_scale = colormap.get('color_scale', 'linear')
+
+    # Pixels outside of the bounds are set to the first or last color
+    norm = np.clip(np.asarray(data, dtype=np.float32), px_min, px_max)
+    bad_pixels = np.isnan(norm)
+    if color_scale == 'linear':
+        norm -= px_min
+        px_range = px_max-px_min
+    elif color_scale == 'log':
+        shift = 1-px_min
+        norm += shift
+        np.log10(norm, out=norm)
+        px_range = math.log10(px_max+shift)
+    else:
+        raise ToyzJobError("Unrecognized colormap scale '{0}'".format(color_scale))
+    if px_range>0:
+        norm *= (lut_size-1)/px_range
+    else:
+        norm[:] = 0
+
+    norm[bad_pixels] = 0
+    if lut_size <= 256:
+        dtype = np.uint8
+    else:
+        dtype = np.uint16
+    return norm.astype(dtype), bad_pixels
+
+def apply_colormap(data, colormap, lut_size=LUT_SIZE):
+    """
+    Map image data to an RGBA image.
+
+    Parameters
+        - data (*numpy array* ): Image data
+        - colormap (*dict* ): Colormap settings for the image (``name``, ``invert_color``,
+          ``px_min``, ``px_max`` and ``color_scale``)
+        - lut_size (*int*, optional): Number of colors in the lookup table
+
+    Returns
+        - rgba (*numpy array* ): uint8 array with shape ``data.shape+(4,)``
+    """
+    lut, bad_color = get_lut(colormap['name'], colormap['invert_color'], lut_size)
+    indices, bad_pixels = get_lut_indices(data, colormap, lut_size)
+    rgba = np.take(lut, indices, axis=0)
+    if bad_pixels.any():
+        rgba[bad_pixels] = bad_color
+    return rgba
+
+# Maximum number of pixels sampled to calculate the bounds of an image
+MAX_SAMPLES = 100000
+
+# Maximum number of pixels sampled for the zscale algorithm (the same as the default used
+# by astropy.visualization.ZScaleInterval). Neighbors of rejected pixels are also rejected,
+# with a kernel that grows with the sample, so larger samples are much slower.
+ZSCALE_SAMPLES = 1000
+
+def get_sample(data, max_samples=MAX_SAMPLES):
+    """
+    Get a sample of at most ``max_samples`` finite pixels from an image. The sample is
+    taken with the same stride along each axis, so for a memory mapped image only the
+    sampled rows are read from disk.
+    """
+    step = max(1, int(math.ceil(math.sqrt(data.size/max_samples))))
+    sample = np.asarray(data[::step, ::step], dtype=float).ravel()
+    return sample[np.isfinite(sample)]
+
+def zscale(sample, contrast=.25, max_reject=.5, min_pixels=5, krej=2.5, max_iterations=5):
+    """
+    Find the bounds of an image using the zscale algorithm from IRAF. A line is fit to the
+    sorted pixel values (iteratively rejecting outliers), and the bounds are the values of
+    the line at the first and last pixel, with the slope divided by ``contrast`` , 
+    centered on the median.
+
+    Parameters
+        - sample (*numpy array* ): Sample of finite pixels from the image
+          (see :py:func:`toyz.web.colormaps.get_sample` ), usually no more than
+          ``ZSCALE_SAMPLES`` pixels
+        - contrast (*float*, optional): Contrast of the bounds, smaller values give a
+          larger range
+        - max_reject (*float*, optional): Maximum fraction of pixels that can be rejected
+        - min_pixels (*int*, optional): Minimum number of pixels needed for the fit
+        - krej (*float*, optional): Number of standard deviations used to reject pixels
+        - max_iterations (*int*, optional): Maximum number of times to reject pixels
+
+    Returns
+        - px_min, px_max (*float* ): Bounds of the image
+    """
+    sample = np.sort(sample)
+    npix = len(sample)
+    px_min = sample[0]
+    px_max = sample[-1]
+    center = (npix-1)//2
+    median = np.median(sample)
+
+    min_good = max(min_pixels, int(npix*(1-max_reject)))
+    x = np.arange(npix)
+    bad_pixels = np.zeros(npix, dtype=bool)
+    good_pixels = npix
+    last_good_pixels = npix+1
+    # Neighbors of rejected pixels are also rejected
+    kernel = np.ones(max(1, int(npix*.01)), dtype=int)
+    slope = None
+    for n in range(max_iterations):
+        if good_pixels>=last_good_pixels or good_pixels<min_good:
+            break
+        slope, intercept = np.polyfit(x, sample, 1, w=(~bad_pixels).astype(int))
+        residuals = sample - (slope*x+intercept)
+        threshold = krej*residuals[~bad_pixels].std()
+        bad_pixels |= np.abs(residuals)>threshold
+        bad_pixels = np.convolve(bad_pixels.astype(int), kernel, mode='same')>0
+        last_good_pixels = good_pixels
+        good_pixels = npix-np.count_nonzero(bad_pixels)
+
+    if slope is not None and good_pixels>=min_good:
+        if contrast>0:
+            slope = slope/contrast
+        px_min = max(px_min, median-center*slope)
+        px_max = min(px_max, median+(npix-center-1)*slope)
+    return float(px_min), float(px_max)
+
+def get_bounds(data, method='zscale', percentile=99.5, max_samples=None):
+    """
+    Calculate the bounds used to display an image.
+
+    Parameters
+        - data (*numpy array* ): Image data
+        - method (*string*, optional): How the bounds are calculated
+            * ``'zscale'``: The zscale algorithm (see :py:func:`toyz.web.colormaps.zscale` )
+              applied to a sample of the image
+            * ``'percentile'``: The bounds contain the central ``percentile`` percent of
+              the pixels in a sample of the image
+            * ``'minmax'``: The minimum and maximum of the entire image
+        - percentile (*float*, optional): Percent of the pixels within the bounds when
+          ``method='percentile'``
+        - max_samples (*int*, optional): Maximum number of pixels sampled (by default
+          ``ZSCALE_SAMPLES`` for zscale and ``MAX_SAMPLES`` for percentiles)
+
+    Returns
+        - px_min, px_max (*float* ): Bounds of the image
+    """
+    if method=='minmax':
+        return float(np.nanmin(data)), float(np.nanmax(data))
+    if max_samples is None:
+        max_samples = ZSCALE_SAMPLES if method=='zscale' else MAX_SAMPLES
+    sample = get_sample(data, max_samples)
+    if sample.size==0:
+        return 0., 0.
+    if method=='zscale':
+        return zscale(sample)
+    elif method=='percentile':
+        lower = (100-percentile)/2
+        px_min, px_max = np.percentile(sample, [lower, 100-lower])
+        return float(px_min), float(px_max)
+    raise ToyzJobError("Unrecognized bounds method '{0}'".format(method))
@@ -0,0 +1,75 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Encodings used for messages sent between the client and the websocket.
+
+Every session can use JSON, which is sent as text messages. If the
+`msgpack <http://msgpack.org>`_ package is installed, the client can ask for
+``msgpack`` when it opens the websocket, in which case jobs and responses are sent as
+binary messages. Numeric lists (for example the columns of a data source) are much
+smaller and faster to decode. In either encoding, binary data (like image tiles) is
+still sent in its own message immediately after the response it belongs to
+(see :py:meth:`toyz.web.app.WebSocketHandler.write_response` ).
+"""
+from __future__ import print_function, division
+
+import tornado.escape
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def get_encodings():
+    """
+    Encodings supported by the server, in order of preference
+    """
+    if msgpack is None:
+        return ['json']
+    return ['msgpack', 'json']
+
+def negotiate(requested):
+    """
+    Choose the encoding for a session.
+    
+    Parameters
+        - requested (*string* ): Comma separated list of encodings supported by the
+          client, in order of preference
+    
+    Returns
+        - encoding (*string* ): The first encoding requested by the client that the server
+          supports, or ``json`` if none of them are supported
+    """
+    encodings = get_encodings()
+    for encoding in requested.split(','):
+        if encoding.strip() in encodings:
+            return encoding.strip()
+    return 'json'
+
+def decode(message, encoding):
+    """
+    Decode a message received from the client. Text messages are always JSON, since the
+    client only switches to another encoding after the session has been initialized.
+    """
+    if encoding == 'msgpack' and isinstance(message, bytes):
+        try:
+            return msgpack.unpackb(message, raw=False)
+        except TypeError:
+            # Older versions of msgpack
+            return msgpack.unpackb(message, encoding='utf-8')
+    return tornado.escape.json_decode(message)
+
+def encode(response, encoding):
+    """
+    Encode a response to send to the client.
+    
+    Returns
+        - message (*bytes* or *dict* ): Encoded response (JSON responses are left as a
+          dictionary, which is encoded by the websocket)
+        - binary (*bool* ): Whether or not the message must be sent as a binary message
+    """
+    if encoding == 'msgpack':
+        # Responses never contain binary data, so all strings (including python 2 ``str``)
+        # are sent as msgpack strings
+        return msgpack.packb(response, use_bin_type=False), True
+    return response, False
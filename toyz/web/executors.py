@@ -0,0 +1,490 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Executors that run jobs sent to the application by a websocket.
+
+Each task is run by one of the following executors:
+
+    - ``session``: A process created for the websocket the first time it runs a job.
+      The process keeps its state in :py:mod:`toyz.web.session_vars` (open images, data
+      sources, etc.) for the rest of the session, so any task that uses session variables
+      must use this executor. Each priority class of jobs (see below) is run one job at a
+      time by its own thread in the process.
+    - ``pool``: A pool of processes shared by all sessions
+    - ``thread``: A pool of threads in the application process shared by all sessions,
+      for short tasks that mostly wait on the database or file system
+    - ``inline``: The job is run immediately in the application process, which blocks
+      the application until it has finished, so this should only be used for trivial tasks
+
+Tasks use the ``session`` executor unless they are listed in ``default_task_executors``
+or in the ``task_executors`` web setting (a dictionary of ``'module.task': executor`` ).
+Only tasks run by the ``session`` executor can send more than one response
+(see :py:func:`toyz.utils.core.send_response` ).
+
+Each task also has a priority class, either ``interactive`` (tasks the user is waiting on,
+like loading image tiles) or ``bulk`` (everything else). ``interactive`` jobs sent to the
+session process never wait for a ``bulk`` job to finish (see
+:py:func:`toyz.web.executors.job_process` ), and jobs run by the other executors are limited to ``max_session_jobs`` at a time for
+each session, with waiting ``interactive`` jobs sent first. Priorities can be changed with the
+``task_priorities`` web setting (a dictionary of ``'module.task': priority`` ).
+
+Every job is kept in the websocket's job registry (``websocket.jobs``, keyed by
+``request_id``) until its final result is received, so the client can cancel a job by
+sending ``{'id': {...}, 'cancel': request_id}`` (see 
+:py:meth:`toyz.web.executors.ToyzExecutors.cancel` ).
+"""
+from __future__ import print_function, division
+import sys
+import threading
+import multiprocessing
+import multiprocessing.pool
+
+import tornado.ioloop
+
+from toyz.utils import core
+from toyz.utils.errors import ToyzWebError
+from toyz.web import session_vars
+
+# Executors for tasks that do not need to be run in the session process
+default_task_executors = {
+    'toyz.web.tasks.load_user_settings': 'thread',
+    'toyz.web.tasks.load_user_info': 'thread',
+    'toyz.web.tasks.save_user_info': 'thread',
+    'toyz.web.tasks.create_paths': 'thread',
+    'toyz.web.tasks.get_workspace_info': 'thread',
+    'toyz.web.tasks.save_workspace': 'thread',
+    'toyz.web.tasks.load_workspace': 'thread',
+    'toyz.web.tasks.get_workspace_sharing': 'thread',
+    'toyz.web.tasks.update_workspace': 'thread',
+    'toyz.web.tasks.load_directory': 'thread',
+    'toyz.web.tasks.add_new_user': 'pool',
+    'toyz.web.tasks.change_pwd': 'pool',
+    'toyz.web.tasks.reset_pwd': 'pool'
+}
+
+# Tasks the user is waiting on, all other tasks have the ``bulk`` priority
+default_task_priorities = {
+    'toyz.web.tasks.load_user_settings': 'interactive',
+    'toyz.web.tasks.load_user_info': 'interactive',
+    'toyz.web.tasks.load_directory': 'interactive',
+    'toyz.web.tasks.get_file_info': 'interactive',
+    'toyz.web.tasks.get_img_info': 'interactive',
+    'toyz.web.tasks.get_tile_info': 'interactive',
+    'toyz.web.tasks.get_img_tile': 'interactive',
+    'toyz.web.tasks.get_img_tiles': 'interactive',
+    'toyz.web.tasks.get_img_data': 'interactive',
+    'toyz.web.tasks.get_img_histogram': 'interactive'
+}
+
+# Priority classes, in the order that waiting jobs are sent
+priorities = core.job_priorities
+
+# Default number of threads in the thread pool
+DEFAULT_JOB_THREADS = 4
+
+# Default number of pool, thread and inline jobs a session can run at the same time
+DEFAULT_MAX_SESSION_JOBS = 4
+
+class SessionPipe:
+    """
+    Pipe to the application shared by the threads of a session process (see
+    :py:func:`toyz.web.executors.job_process` ). Only the thread that created the pipe
+    reads messages from the application, the threads running jobs wait for it to receive
+    them instead. Messages sent by different threads are never interleaved.
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.reader = threading.current_thread()
+        self.send_lock = threading.Lock()
+    
+    def send(self, msg):
+        with self.send_lock:
+            self.pipe.send(msg)
+    
+    def recv(self):
+        return self.pipe.recv()
+    
+    def poll(self, timeout=0):
+        """
+        Check for a message from the application. In the threads running jobs this
+        waits for the reader to receive a message instead (the caller must hold
+        ``toyz.utils.core.session_condition`` ) and always returns **False** .
+        """
+        if threading.current_thread() is self.reader:
+            return self.pipe.poll(timeout)
+        if timeout is None:
+            core.session_condition.wait()
+        elif timeout>0:
+            core.session_condition.wait(timeout)
+        return False
+
+def run_session_jobs(pipe, priority):
+    """
+    Run the jobs in one priority class, one at a time, in a thread of the session process
+    """
+    while True:
+        msg = core.get_next_job(pipe, priority)
+        pipe.send(core.run_job(msg['toyz_settings'], pipe, msg['job']))
+
+def job_process(session_id, pipe, websocket_pipe):
+    """
+    Process created for the websocket. When a job is received from the Toyz
+    Application it is run in this process and a response is sent.
+    
+    Each priority class of jobs is run by its own thread, so that ``interactive`` jobs
+    (like loading image tiles) are not stuck waiting for a long ``bulk`` job to finish.
+    Both threads share the session variables, while the main thread reads the messages
+    from the application (see :py:func:`toyz.utils.core.receive_jobs` ).
+    """
+    websocket_pipe.close()
+    session_vars.session_process = True
+    session_pipe = SessionPipe(pipe)
+    for priority in priorities:
+        thread = threading.Thread(target=run_session_jobs, args=(session_pipe, priority))
+        thread.daemon = True
+        thread.start()
+    while True:
+        try:
+            # Wait for the next message (if the pipe is closed this returns and the next 
+            # attempt to read raises an EOFError)
+            pipe.poll(None)
+            core.receive_jobs(session_pipe)
+        except EOFError:
+            break
+    print('job_process {0} finished'.format(session_id))
+
+# Settings of the application, loaded when a process in the shared pool is started, and
+# the version of the settings the process last ran a job with
+pool_settings = None
+pool_settings_version = None
+
+def init_pool_process(toyz_settings, settings_version):
+    """
+    Initialize a process in the shared process pool. The toyz settings are only sent once 
+    to each process, and the pool is replaced when they change.
+    """
+    global pool_settings, pool_settings_version
+    pool_settings = toyz_settings
+    pool_settings_version = settings_version
+
+def run_pool_job(job, settings_version):
+    """
+    Run a job in a process of the shared process pool. If the user settings have changed
+    since the last job run by the process its module cache is cleared first
+    (see :py:func:`toyz.utils.core.load_job_settings` ).
+    """
+    global pool_settings_version
+    if pool_settings_version != settings_version:
+        core.clear_module_cache()
+        pool_settings_version = settings_version
+    return core.run_job(pool_settings, None, job)
+
+class WebsocketPipe:
+    """
+    Pipe used by jobs run in the application process to send responses to a websocket.
+    Responses are written by the IOLoop, since the websocket can only be used from the
+    thread running the IOLoop.
+    """
+    def __init__(self, websocket, io_loop):
+        self.websocket = websocket
+        self.io_loop = io_loop
+    
+    def send(self, result):
+        self.io_loop.add_callback(self.websocket.send_result, result)
+    
+    def poll(self):
+        """
+        Jobs are never waiting in the pipe, since each one is run as soon as it is received
+        """
+        return False
+
+class ToyzExecutors:
+    """
+    Executors used by the application to run jobs.
+    """
+    def __init__(self, toyz_settings):
+        self.toyz_settings = toyz_settings
+        # Incremented each time the settings change, so that the settings are only sent to
+        # session processes that have an old version
+        self.settings_version = 0
+        self.process_pool = None
+        self.thread_pool = None
+    
+    def update_settings(self, toyz_settings, reload_pool=False):
+        """
+        Use new settings for all jobs sent after this is called. Session and pool 
+        processes receive the new version with their next job. Only a change to the
+        toyz settings themselves (``reload_pool=True`` ) replaces the shared process pool,
+        since its processes load the settings when they start. Jobs already running in
+        the old pool finish with the old settings and their results are still sent.
+        """
+        self.toyz_settings = toyz_settings
+        self.settings_version += 1
+        if reload_pool and self.process_pool is not None:
+            old_pool = self.process_pool
+            old_pool.close()
+            # Keep a reference to the old pool until all of its jobs have finished and
+            # their callbacks have run
+            thread = threading.Thread(target=old_pool.join)
+            thread.daemon = True
+            thread.start()
+            self.process_pool = None
+    
+    def get_executor(self, job):
+        """
+        Name of the executor used to run a job. A batch of jobs (see
+        :py:func:`toyz.utils.core.run_batch` ) uses the executor shared by all of its jobs,
+        or the ``session`` executor if they use different executors.
+        """
+        if 'batch' in job:
+            executors = set([self.get_executor(item) for item in job['batch']])
+            if len(executors)==1:
+                return executors.pop()
+            return 'session'
+        task = job['module']+'.'+job['task']
+        task_executors = getattr(self.toyz_settings.web, 'task_executors', {})
+        if task in task_executors:
+            executor = task_executors[task]
+        else:
+            executor = default_task_executors.get(task, 'session')
+        if executor not in ['session', 'pool', 'thread', 'inline']:
+            raise ToyzWebError("Unrecognized executor '{0}' for task '{1}'".format(
+                executor, task))
+        return executor
+    
+    def get_process_pool(self):
+        """
+        Get the shared process pool, creating it the first time it is needed
+        """
+        if self.process_pool is None:
+            processes = getattr(self.toyz_settings.web, 'job_processes', None)
+            if processes is None:
+                processes = multiprocessing.cpu_count()
+            self.process_pool = multiprocessing.Pool(processes, 
+                init_pool_process, (self.toyz_settings, self.settings_version))
+        return self.process_pool
+    
+    def get_thread_pool(self):
+        """
+        Get the shared thread pool, creating it the first time it is needed
+        """
+        if self.thread_pool is None:
+            threads = getattr(self.toyz_settings.web, 'job_threads', DEFAULT_JOB_THREADS)
+            self.thread_pool = multiprocessing.pool.ThreadPool(threads)
+        return self.thread_pool
+    
+    def get_priority(self, job):
+        """
+        Priority class of a job (either ``interactive`` or ``bulk`` ). A batch of jobs
+        is ``interactive`` if any of its jobs are.
+        """
+        if 'batch' in job:
+            batch_priorities = [self.get_priority(item) for item in job['batch']]
+            return min(batch_priorities+['bulk'], key=priorities.index)
+        task = job['module']+'.'+job['task']
+        task_priorities = getattr(self.toyz_settings.web, 'task_priorities', {})
+        if task in task_priorities:
+            priority = task_priorities[task]
+        else:
+            priority = default_task_priorities.get(task, 'bulk')
+        if priority not in priorities:
+            raise ToyzWebError("Unrecognized priority '{0}' for task '{1}'".format(
+                priority, task))
+        return priority
+    
+    def init_session(self, websocket):
+        """
+        Initialize the job registry of a new websocket. The session process is only started
+        the first time it is needed.
+        """
+        websocket.job_pipe = None
+        websocket.process = None
+        websocket.settings_version = None
+        websocket.jobs = {}
+        websocket.job_queue = []
+    
+    def get_session_pipe(self, websocket):
+        """
+        Get the pipe to a websocket's session process, starting the process the first
+        time it is needed
+        """
+        if websocket.job_pipe is None:
+            websocket.settings_version = None
+            websocket.job_pipe, remote_pipe = multiprocessing.Pipe()
+            websocket.process = multiprocessing.Process(
+                target = job_process,
+                args=(websocket.session['session_id'], remote_pipe, websocket.job_pipe))
+            websocket.process.start()
+            remote_pipe.close()
+            process_events = (tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
+            tornado.ioloop.IOLoop.current().add_handler(
+                websocket.job_pipe, websocket.send_response, process_events)
+        return websocket.job_pipe
+    
+    def submit(self, websocket, job):
+        """
+        Add a job sent from a websocket to the session's job registry and run it (if the
+        session is not already running the maximum number of jobs). The response is sent
+        to the websocket when the job has finished.
+        """
+        entry = {
+            'job': job,
+            'executor': self.get_executor(job),
+            'priority': self.get_priority(job),
+            'running': False,
+            'cancelled': False
+        }
+        websocket.jobs[job['id']['request_id']] = entry
+        if entry['executor'] == 'session':
+            # The session process runs the jobs in each priority class one at a time
+            self.run(websocket, entry)
+        else:
+            websocket.job_queue.append(entry)
+            self.dispatch(websocket)
+    
+    def dispatch(self, websocket):
+        """
+        Run the jobs waiting in a session's queue, ``interactive`` jobs first, until the
+        session is running ``max_session_jobs`` pool, thread and inline jobs.
+        """
+        max_jobs = getattr(self.toyz_settings.web, 'max_session_jobs', 
+            DEFAULT_MAX_SESSION_JOBS)
+        while len(websocket.job_queue)>0:
+            running = len([entry for entry in websocket.jobs.values() 
+                if entry['running'] and entry['executor']!='session'])
+            if running>=max_jobs:
+                break
+            entry = min(websocket.job_queue, key=lambda e: priorities.index(e['priority']))
+            websocket.job_queue.remove(entry)
+            self.run(websocket, entry)
+    
+    def run(self, websocket, entry):
+        """
+        Send a job to its executor
+        """
+        io_loop = tornado.ioloop.IOLoop.current()
+        job = entry['job']
+        entry['running'] = True
+        if entry['executor'] == 'session':
+            pipe = self.get_session_pipe(websocket)
+            msg = {'job': job, 'priority': entry['priority']}
+            # The session process keeps the last settings it received
+            if websocket.settings_version != self.settings_version:
+                msg['toyz_settings'] = self.toyz_settings
+                websocket.settings_version = self.settings_version
+            pipe.send(msg)
+        elif entry['executor'] == 'pool':
+            self.apply_async(self.get_process_pool(), run_pool_job, 
+                (job, self.settings_version),
+                lambda result: io_loop.add_callback(websocket.send_result, result),
+                lambda error: io_loop.add_callback(self.send_error, websocket, job, error))
+        elif entry['executor'] == 'thread':
+            pipe = WebsocketPipe(websocket, io_loop)
+            self.apply_async(self.get_thread_pool(), core.run_job,
+                (self.toyz_settings, pipe, job), pipe.send,
+                lambda error: io_loop.add_callback(self.send_error, websocket, job, error))
+        else:
+            websocket.send_result(core.run_job(self.toyz_settings, None, job))
+    
+    def apply_async(self, pool, func, args, callback, error_callback):
+        """
+        Run a job in one of the shared pools. If the job raises an error outside of its
+        task (for example its result cannot be pickled) ``error_callback`` is called
+        instead of ``callback`` (only in python 3, since python 2 pools do not have an
+        error callback).
+        """
+        if sys.version_info[0]>=3:
+            return pool.apply_async(func, args, 
+                callback=callback, error_callback=error_callback)
+        return pool.apply_async(func, args, callback=callback)
+    
+    def run_session_task(self, websocket, task):
+        """
+        Run a task sent by a websocket's session process in the shared process pool and
+        send the result back to the session process 
+        (see :py:func:`toyz.utils.core.run_pool_task` ). Session jobs use this to split
+        work (like rendering image tiles) across the pool, so that sessions never need
+        processes of their own besides the session process.
+        """
+        io_loop = tornado.ioloop.IOLoop.current()
+        def send_task_result(result, error=None):
+            # The session may have been closed while the task was running
+            if websocket.job_pipe is not None:
+                websocket.job_pipe.send({
+                    'pool_task': task['task_id'],
+                    'result': result,
+                    'error': error
+                })
+        self.apply_async(self.get_process_pool(), task['func'], task['args'],
+            lambda result: io_loop.add_callback(send_task_result, result),
+            lambda error: io_loop.add_callback(send_task_result, None,
+                "PYTHON ERROR:"+type(error).__name__+str(error.args)))
+    
+    def send_error(self, websocket, job, error):
+        """
+        Send the final result of a job that failed in one of the shared pools, so that it
+        is removed from the job registry and does not take up one of the session's
+        ``max_session_jobs`` forever.
+        """
+        websocket.send_result({
+            'id': job['id'],
+            'response': {
+                'id': 'ERROR',
+                'error': "PYTHON ERROR:"+type(error).__name__+str(error.args),
+                'traceback': '',
+                'request_id': job['id']['request_id']
+            },
+            'complete': True
+        })
+    
+    def receive_result(self, websocket, result):
+        """
+        Update the job registry when a result is received from a job. The final result
+        (``complete=True`` ) removes the job from the registry and lets the next waiting
+        job run.
+        
+        Returns
+            - send (*bool* ): Whether or not the response should be sent to the client,
+              which is **False** for jobs that have been cancelled
+        """
+        request_id = result['id']['request_id']
+        entry = websocket.jobs.get(request_id)
+        if entry is None:
+            return True
+        if result.get('complete', False):
+            del websocket.jobs[request_id]
+            if entry['executor'] != 'session':
+                self.dispatch(websocket)
+        return not entry['cancelled']
+    
+    def cancel(self, websocket, request_id):
+        """
+        Cancel a job from a websocket. A job that has not started is removed from the
+        queue, and running session jobs are told to stop (see 
+        :py:func:`toyz.utils.core.job_cancelled` ). Jobs running in the shared pools cannot
+        be stopped, but any responses they send are ignored.
+        """
+        entry = websocket.jobs.get(request_id)
+        if entry is None or entry['cancelled']:
+            return
+        entry['cancelled'] = True
+        if entry['executor'] == 'session':
+            websocket.job_pipe.send({'cancel': request_id})
+        elif not entry['running']:
+            websocket.job_queue.remove(entry)
+            del websocket.jobs[request_id]
+        websocket.write_response({
+            'id': 'cancelled',
+            'request_id': request_id,
+            'finished': True
+        })
+    
+    def close_session(self, websocket):
+        """
+        Close the session process of a websocket (if one was started)
+        """
+        if websocket.job_pipe is not None:
+            tornado.ioloop.IOLoop.current().remove_handler(websocket.job_pipe)
+            websocket.job_pipe.close()
+            websocket.job_pipe = None
+        websocket.job_queue = []
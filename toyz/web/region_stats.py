@@ -0,0 +1,286 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Statistics for rectangular regions of an image frame.
+
+The first time statistics are requested for a frame, summed-area tables (integral images)
+of the pixel values and their squares are built (a block of rows at a time), so the mean and standard deviation of any
+rectangle in the frame only require four lookups in each table. Medians are found with
+``np.partition`` instead of sorting the entire region.
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import numpy as np
+
+from toyz.utils.errors import ToyzJobError
+from toyz.web import session_vars
+
+# Set the default values for the sessions global variables if they have not already been set
+if not hasattr(session_vars, 'integral_images'):
+    session_vars.integral_images = OrderedDict()
+if not hasattr(session_vars, 'histograms'):
+    session_vars.histograms = {}
+
+# Integral images are only built for frames with up to this many pixels (2048x2048), since
+# the sum and sum of squares tables need float64 precision and use 8 bytes per pixel each
+# (about 80 MB for a frame at the limit, including the int32 count table). Larger frames
+# use the pixels in the region instead.
+MAX_INTEGRAL_PIXELS = 2**22
+
+# Number of frames that integral images are kept for, after which the tables of the least
+# recently used frame are removed
+MAX_INTEGRAL_IMAGES = 1
+
+# Number of pixels read at a time when building integral images or histograms, so that a
+# large memory mapped frame is never loaded into memory (or converted to float64) at once
+CHUNK_SIZE = 2**22
+
+def clear_cache(filepath):
+    """
+    Remove the integral images and histograms for all of the frames in an image file.
+    """
+    for cache in [session_vars.integral_images, session_vars.histograms]:
+        for key in list(cache.keys()):
+            if key[0]==filepath:
+                del cache[key]
+
+def clip_region(data, region):
+    """
+    Clip the ``x0``, ``y0``, ``xf``, ``yf`` bounds of a region to the edges of a frame, so
+    that negative bounds do not wrap around to the other side of the frame. Raises a
+    :py:class:`toyz.utils.errors.ToyzJobError` if the region is not in the frame.
+    
+    Returns
+        - region (*list* ): ``[x0, y0, xf, yf]`` bounds of the clipped region
+    """
+    height, width = data.shape[:2]
+    x0, y0, xf, yf = [int(region[k]) for k in ['x0', 'y0', 'xf', 'yf']]
+    x0, xf = max(0, x0), min(width, xf)
+    y0, yf = max(0, y0), min(height, yf)
+    if xf<=x0 or yf<=y0:
+        raise ToyzJobError("The region {0} is not in the {1}x{2} frame".format(
+            [region[k] for k in ['x0', 'y0', 'xf', 'yf']], width, height))
+    return [x0, y0, xf, yf]
+
+def get_median(data):
+    """
+    Median of the finite pixels in an array, using ``np.partition`` to find the middle
+    pixel(s) in linear time.
+    """
+    data = np.asarray(data).ravel()
+    data = data[np.isfinite(data)]
+    n = data.size
+    if n==0:
+        return np.nan
+    if n%2==1:
+        return float(np.partition(data, n//2)[n//2])
+    data = np.partition(data, [n//2-1, n//2])
+    return float((data[n//2-1]+data[n//2])/2)
+
+def iter_rows(data):
+    """
+    Iterate over a 2D array a block of rows at a time, yielding the index of the first row
+    in the block and the block converted to float64. Each block is a copy, so it can be
+    modified without changing ``data`` .
+    """
+    rows = max(1, CHUNK_SIZE//max(1, data.shape[1]))
+    for row in range(0, data.shape[0], rows):
+        yield row, np.array(data[row:row+rows], dtype=np.float64)
+
+def integrate_rows(table, row, block):
+    """
+    Fill the rows of a summed-area table for a block of rows of an image that starts at
+    ``row``, using the rows of the table above the block (which must already be filled).
+    """
+    rows = table[row+1:row+1+block.shape[0], 1:]
+    np.cumsum(block, axis=1, dtype=table.dtype, out=rows)
+    np.cumsum(rows, axis=0, out=rows)
+    rows += table[row, 1:]
+
+def build_integral_images(data):
+    """
+    Build the summed-area tables for an image frame. Each table has an extra row and column
+    of zeros at the start so that sums over rectangles touching the edge of the image need
+    no special cases. Pixel values are shifted by the mean of the frame before the squares
+    are summed, which keeps the variance accurate for images with a large offset.
+    
+    Returns
+        - tables (*dict* ): ``sum`` and ``sum2`` (sum of squares) tables, the ``offset``
+          subtracted from each pixel and a ``count`` table of finite pixels (or **None** if
+          all of the pixels are finite)
+    """
+    # The frame is read twice, a block of rows at a time: once to find the offset and
+    # once to fill the tables, so only the tables themselves use memory for every pixel
+    total = 0.
+    count = 0
+    for row, block in iter_rows(data):
+        finite = np.isfinite(block)
+        total += block[finite].sum()
+        count += int(finite.sum())
+    offset = total/count if count>0 else 0.
+    
+    height, width = data.shape
+    tables = {
+        'sum': np.zeros((height+1, width+1), dtype=np.float64),
+        'sum2': np.zeros((height+1, width+1), dtype=np.float64),
+        'offset': float(offset),
+        'count': None
+    }
+    if count<data.size:
+        # The count never exceeds MAX_INTEGRAL_PIXELS
+        tables['count'] = np.zeros((height+1, width+1), dtype=np.int32)
+    for row, block in iter_rows(data):
+        finite = np.isfinite(block)
+        block -= offset
+        block[~finite] = 0
+        integrate_rows(tables['sum'], row, block)
+        integrate_rows(tables['sum2'], row, block*block)
+        if tables['count'] is not None:
+            integrate_rows(tables['count'], row, finite)
+    return tables
+
+def get_integral_images(file_info, img_info, data):
+    """
+    Get the summed-area tables for an image frame (see
+    :py:func:`toyz.web.region_stats.build_integral_images` ), building them the first time
+    they are needed. Only the tables for the last ``MAX_INTEGRAL_IMAGES`` frames used are
+    kept. Returns **None** if the frame is too large or not a 2D image.
+    """
+    key = (file_info['filepath'], str(img_info['frame']))
+    integral_images = session_vars.integral_images
+    if key in integral_images:
+        # Move the tables to the end of the queue so that they are removed last
+        integral_images[key] = integral_images.pop(key)
+    else:
+        if data.ndim!=2 or data.size>MAX_INTEGRAL_PIXELS:
+            return None
+        # Remove the old tables first so that they are not in memory while the new
+        # tables are built
+        while len(integral_images)>=MAX_INTEGRAL_IMAGES:
+            integral_images.popitem(last=False)
+        integral_images[key] = build_integral_images(data)
+    return integral_images[key]
+
+def rect_sum(table, x0, y0, xf, yf):
+    """
+    Sum of the pixels in ``[y0:yf, x0:xf]`` from a summed-area table.
+    """
+    return table[yf,xf]-table[y0,xf]-table[yf,x0]+table[y0,x0]
+
+def get_region_stats(file_info, img_info, data, x0, y0, xf, yf):
+    """
+    Get the statistics of the pixels in the region ``data[y0:yf, x0:xf]`` of an image frame.
+    NaN pixels are ignored, and if there are no finite pixels all of the statistics are
+    **None** .
+    
+    Returns
+        - stats (*dict* ): ``min``, ``max``, ``mean``, ``median`` and ``std_dev`` of the
+          region
+    """
+    region = np.asarray(data[y0:yf, x0:xf])
+    finite = region[np.isfinite(region)]
+    if finite.size==0:
+        return {
+            'min': None,
+            'max': None,
+            'mean': None,
+            'median': None,
+            'std_dev': None
+        }
+    stats = {
+        'min': float(finite.min()),
+        'max': float(finite.max()),
+        'median': get_median(finite)
+    }
+    
+    tables = get_integral_images(file_info, img_info, data)
+    if tables is None:
+        stats['mean'] = float(finite.mean())
+        stats['std_dev'] = float(finite.std())
+    else:
+        if tables['count'] is None:
+            count = (xf-x0)*(yf-y0)
+        else:
+            count = rect_sum(tables['count'], x0, y0, xf, yf)
+        mean = rect_sum(tables['sum'], x0, y0, xf, yf)/count
+        variance = rect_sum(tables['sum2'], x0, y0, xf, yf)/count - mean*mean
+        stats['mean'] = float(mean+tables['offset'])
+        stats['std_dev'] = float(np.sqrt(max(variance, 0)))
+    return stats
+
+def iter_chunks(data):
+    """
+    Iterate over the finite pixels of a 2D array, a block of rows at a time.
+    """
+    for row, block in iter_rows(data):
+        chunk = block.ravel()
+        yield chunk[np.isfinite(chunk)]
+
+def get_histogram_edges(px_min, px_max, bins, log=False):
+    """
+    Get the edges of the bins for a histogram. If ``log`` is **True** the bins are evenly
+    spaced in ``log10(pixel+shift)`` , with the same ``shift=1-px_min`` used by the
+    ``log`` colormap scale, so that images with negative pixels can still use log bins.
+    """
+    if not log:
+        return np.linspace(px_min, px_max, bins+1)
+    shift = 1-px_min
+    return np.logspace(np.log10(px_min+shift), np.log10(px_max+shift), bins+1)-shift
+
+def get_histogram(file_info, img_info, data, bins=256, log=False, px_range=None, 
+        region=None):
+    """
+    Get the histogram of the finite pixels in an image frame or a region of the frame.
+    Histograms are stored in ``session_vars.histograms`` until the file is closed.
+    
+    Parameters
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame
+        - data (*numpy array* ): Data for the frame
+        - bins (*int*, optional): Number of bins
+        - log (*bool*, optional): Whether or not to use logarithmic bins 
+          (see :py:func:`toyz.web.region_stats.get_histogram_edges` )
+        - px_range (*list*, optional): ``[px_min, px_max]`` range of the histogram. By
+          default the range of the pixels in the frame (or region) is used
+        - region (*dict*, optional): ``x0``, ``y0``, ``xf``, ``yf`` bounds of a region in
+          the frame (see :py:func:`toyz.web.region_stats.clip_region` ). By default the
+          entire frame is used
+    
+    Returns
+        - histogram (*dict* ): ``counts`` in each bin and the ``edges`` of the bins (with
+          one more edge than the number of bins)
+    """
+    if region is not None:
+        region = clip_region(data, region)
+        data = data[region[1]:region[3], region[0]:region[2]]
+    if px_range is not None:
+        px_range = [float(px_range[0]), float(px_range[1])]
+    key = (file_info['filepath'], str(img_info['frame']), int(bins), bool(log), 
+        None if px_range is None else tuple(px_range), 
+        None if region is None else tuple(region))
+    if key in session_vars.histograms:
+        return session_vars.histograms[key]
+    
+    if px_range is None:
+        px_min = np.inf
+        px_max = -np.inf
+        for chunk in iter_chunks(data):
+            if chunk.size>0:
+                px_min = min(px_min, chunk.min())
+                px_max = max(px_max, chunk.max())
+        if px_min>px_max:
+            px_min = px_max = 0.
+        px_range = [float(px_min), float(px_max)]
+    if px_range[1]<=px_range[0]:
+        px_range[1] = px_range[0]+1
+    
+    edges = get_histogram_edges(px_range[0], px_range[1], bins, log)
+    counts = np.zeros(bins, dtype=np.int64)
+    for chunk in iter_chunks(data):
+        counts += np.histogram(chunk, bins=edges)[0]
+    histogram = {
+        'counts': counts.tolist(),
+        'edges': edges.tolist()
+    }
+    session_vars.histograms[key] = histogram
+    return histogram
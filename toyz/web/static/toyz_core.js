@@ -70,6 +70,199 @@ Toyz.Core.get_namespace=function(full_name, context) {
     return context;
 };
 
+// Minimal msgpack codec used when the server supports it (see toyz/web/encoding.py).
+// Jobs and responses are sent as binary messages, which are smaller and faster to decode
+// than JSON for large numeric lists.
+Toyz.namespace('Toyz.Core.msgpack');
+Toyz.Core.msgpack.supported = function(){
+    return window.TextEncoder!==undefined && window.TextDecoder!==undefined;
+};
+Toyz.Core.msgpack.encode = function(value){
+    var bytes = [];
+    var utf8 = new TextEncoder();
+    var write_uint = function(value, size){
+        for(var i=size-1; i>=0; i--){
+            bytes.push(Math.floor(value/Math.pow(2, 8*i))%256);
+        };
+    };
+    var write_bytes = function(data){
+        for(var i=0; i<data.length; i++){
+            bytes.push(data[i]);
+        };
+    };
+    var write_header = function(length, fix, fix_max, codes){
+        if(fix!==undefined && length<=fix_max){
+            bytes.push(fix+length);
+        }else if(codes[0]!==undefined && length<256){
+            bytes.push(codes[0]);
+            write_uint(length, 1);
+        }else if(length<65536){
+            bytes.push(codes[1]);
+            write_uint(length, 2);
+        }else{
+            bytes.push(codes[2]);
+            write_uint(length, 4);
+        };
+    };
+    var write = function(value){
+        if(value===null || value===undefined){
+            bytes.push(0xc0);
+        }else if(value===true || value===false){
+            bytes.push(value ? 0xc3 : 0xc2);
+        }else if(typeof value=='number'){
+            if(value%1===0 && value>=0 && value<Math.pow(2,32)){
+                if(value<128){
+                    bytes.push(value);
+                }else if(value<256){
+                    bytes.push(0xcc);
+                    write_uint(value, 1);
+                }else if(value<65536){
+                    bytes.push(0xcd);
+                    write_uint(value, 2);
+                }else{
+                    bytes.push(0xce);
+                    write_uint(value, 4);
+                };
+            }else if(value%1===0 && value<0 && value>=-32){
+                bytes.push(256+value);
+            }else if(value%1===0 && value<0 && value>=-Math.pow(2,31)){
+                bytes.push(0xd2);
+                write_uint(Math.pow(2,32)+value, 4);
+            }else{
+                var view = new DataView(new ArrayBuffer(8));
+                view.setFloat64(0, value);
+                bytes.push(0xcb);
+                write_bytes(new Uint8Array(view.buffer));
+            };
+        }else if(typeof value=='string'){
+            var str = utf8.encode(value);
+            write_header(str.length, 0xa0, 31, [0xd9, 0xda, 0xdb]);
+            write_bytes(str);
+        }else if(value instanceof ArrayBuffer || ArrayBuffer.isView(value)){
+            var data = value instanceof ArrayBuffer ? new Uint8Array(value) :
+                new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+            write_header(data.length, undefined, 0, [0xc4, 0xc5, 0xc6]);
+            write_bytes(data);
+        }else if(Array.isArray(value)){
+            write_header(value.length, 0x90, 15, [undefined, 0xdc, 0xdd]);
+            for(var i=0; i<value.length; i++){
+                write(value[i]);
+            };
+        }else{
+            // Like JSON.stringify, keys with undefined values and functions are skipped
+            var keys = [];
+            for(var key in value){
+                if(value.hasOwnProperty(key) && value[key]!==undefined && 
+                        typeof value[key]!='function'){
+                    keys.push(key);
+                };
+            };
+            write_header(keys.length, 0x80, 15, [undefined, 0xde, 0xdf]);
+            for(var i=0; i<keys.length; i++){
+                write(keys[i]);
+                write(value[keys[i]]);
+            };
+        };
+    };
+    write(value);
+    return new Uint8Array(bytes).buffer;
+};
+Toyz.Core.msgpack.decode = function(buffer){
+    var view = new DataView(buffer);
+    var utf8 = new TextDecoder('utf-8');
+    var offset = 0;
+    var read_uint = function(size){
+        var value = 0;
+        for(var i=0; i<size; i++){
+            value = value*256+view.getUint8(offset+i);
+        };
+        offset += size;
+        return value;
+    };
+    var read_int = function(size){
+        var value = read_uint(size);
+        var max = Math.pow(2, 8*size);
+        return value>=max/2 ? value-max : value;
+    };
+    var read_str = function(length){
+        var value = utf8.decode(new Uint8Array(buffer, offset, length));
+        offset += length;
+        return value;
+    };
+    var read_bin = function(length){
+        var value = buffer.slice(offset, offset+length);
+        offset += length;
+        return value;
+    };
+    var read_array = function(length){
+        var value = [];
+        for(var i=0; i<length; i++){
+            value.push(read());
+        };
+        return value;
+    };
+    var read_map = function(length){
+        var value = {};
+        for(var i=0; i<length; i++){
+            var key = read();
+            value[key] = read();
+        };
+        return value;
+    };
+    var read = function(){
+        var code = read_uint(1);
+        var value;
+        if(code<0x80){
+            return code;
+        }else if(code<0x90){
+            return read_map(code-0x80);
+        }else if(code<0xa0){
+            return read_array(code-0x90);
+        }else if(code<0xc0){
+            return read_str(code-0xa0);
+        }else if(code>=0xe0){
+            return code-256;
+        };
+        switch(code){
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return read_bin(read_uint(1));
+            case 0xc5: return read_bin(read_uint(2));
+            case 0xc6: return read_bin(read_uint(4));
+            case 0xca:
+                value = view.getFloat32(offset);
+                offset += 4;
+                return value;
+            case 0xcb:
+                value = view.getFloat64(offset);
+                offset += 8;
+                return value;
+            case 0xcc: return read_uint(1);
+            case 0xcd: return read_uint(2);
+            case 0xce: return read_uint(4);
+            case 0xcf: return read_uint(8);
+            case 0xd0: return read_int(1);
+            case 0xd1: return read_int(2);
+            case 0xd2: return read_int(4);
+            case 0xd3:
+                // Split into two words, since bitwise operators only use 32 bits
+                value = view.getInt32(offset)*Math.pow(2,32)+view.getUint32(offset+4);
+                offset += 8;
+                return value;
+            case 0xd9: return read_str(read_uint(1));
+            case 0xda: return read_str(read_uint(2));
+            case 0xdb: return read_str(read_uint(4));
+            case 0xdc: return read_array(read_uint(2));
+            case 0xdd: return read_array(read_uint(4));
+            case 0xde: return read_map(read_uint(2));
+            case 0xdf: return read_map(read_uint(4));
+        };
+        throw "Unsupported msgpack type: "+code;
+    };
+    return read();
+};
+
 // Maximum requestId of a request sent to the server during a single session 
 // before looping back to zero
 Toyz.Core.MAX_ID=Math.pow(2,40);
@@ -132,7 +325,8 @@ Toyz.Core.Websocket.prototype.send_task = function(request){
         // recieved from the server such as a callback, rx_error, notify, warn, etc.
         this.requests[task.id.request_id.toString()]=request;
         //console.log('sending', task);
-        this.ws.send(JSON.stringify(task));
+        this.send_message(task);
+        return task.id.request_id;
     }else if(this.ws.readyState>1){
         // TODO: Warn user connection was lost and give the option to reconnect
         if(this.logger){
@@ -150,13 +344,45 @@ Toyz.Core.Websocket.prototype.send_task = function(request){
         this.queue.push(request);
     };
 };
+// Cancel a task sent to the server. Any responses the task sends after it has been
+// cancelled are ignored by the server, and the request's ``cancelled`` function (if it
+// has one) is called once the server has cancelled the task
+Toyz.Core.Websocket.prototype.cancel_task = function(request_id){
+    if(this.ws.readyState==1 && this.requests.hasOwnProperty(request_id.toString())){
+        this.send_message({
+            id: {
+                user_id: this.user_id,
+                session_id: this.session_id
+            },
+            cancel: request_id
+        });
+    };
+};
+// Encode a message using the encoding chosen by the server when the session was
+// initialized
+Toyz.Core.Websocket.prototype.send_message = function(msg){
+    if(this.encoding=='msgpack'){
+        this.ws.send(Toyz.Core.msgpack.encode(msg));
+    }else{
+        this.ws.send(JSON.stringify(msg));
+    };
+};
 Toyz.Core.Websocket.prototype.connect_ws = function(options){
     options = $.extend(true, {}, options);
     var url="ws://"+location.host+this.job_url;
     if(options.hasOwnProperty('session_id')){
         url = url + options.session_id
     };
+    // Ask the server to use msgpack if the browser supports it, all messages are sent as
+    // JSON until the server has chosen the encoding
+    this.encoding = 'json';
+    if(Toyz.Core.msgpack.supported()){
+        url = url + '?encoding=msgpack,json';
+    };
     this.ws = new WebSocket(url);
+    // Binary messages (such as image tiles) are received as array buffers
+    this.ws.binaryType = 'arraybuffer';
+    this.binary_header = undefined;
         
     if(this.hasOwnProperty('onopen')){
         this.ws.onopen = this.onopen;
@@ -202,36 +428,55 @@ Toyz.Core.Websocket.prototype.connect_ws = function(options){
     }
 	this.ws.onmessage=function(event){
         //console.log('event', event);
-		var result = JSON.parse(event.data);
+        var result;
+        if(event.data instanceof ArrayBuffer && this.binary_header!==undefined){
+            // Binary data always immediately follows the response it belongs to
+            result = this.binary_header;
+            result.binary = event.data;
+            this.binary_header = undefined;
+        }else{
+            if(event.data instanceof ArrayBuffer){
+                result = Toyz.Core.msgpack.decode(event.data);
+            }else{
+                result = JSON.parse(event.data);
+            };
+            if(result.binary===true){
+                // Wait for the binary data before processing the response
+                this.binary_header = result;
+                return;
+            };
+        };
         var request = this.requests[result.request_id];
         // For initialization, there won't be a request stored
         if(request===undefined){
             request = {};
         };
-        // Special cases of responses from the server
-        var responses = {
-            ERROR: 'rx_error',
-            notification: 'notify',
-            warning: 'warning',
-            initialize: 'init_ws'
-        };
-        for(var response in responses){
-            if(result.id==response){
-                var exit;
-                if(request.hasOwnProperty(response)){
-                    exit = request[response](result);
-                }else{
-                    exit = this[responses[response]](result);
-                };
-                if(exit){
-                    return;
+        // The server has cancelled the task (see cancel_task)
+        if(result.id=='cancelled'){
+            if(request.hasOwnProperty('cancelled')){
+                request.cancelled(result);
+            };
+            delete this.requests[result.request_id];
+            return;
+        };
+        // Responses to tasks sent in a batch (see send_batch) are passed to the request
+        // for the task in the batch
+        if(request.hasOwnProperty('batch')){
+            if(result.hasOwnProperty('batch_idx')){
+                this.rx_response(request.batch[result.batch_idx], result);
+            }else if(result.id=='batch'){
+                for(var i=0; i<result.responses.length; i++){
+                    var response = result.responses[i];
+                    this.rx_response(request.batch[response.batch_idx], response);
                 };
+                delete this.requests[result.request_id];
+            }else{
+                this.rx_response(request, result);
             };
+            return;
         };
-        if(request.hasOwnProperty('callback')){
-            request.callback(result);
-        }else{
-            this.rx_action(result);
+        if(this.rx_response(request, result)){
+            return;
         };
         // Since some tasks will return notifications and warnings, only remove the
         // request if the 
@@ -240,9 +485,63 @@ Toyz.Core.Websocket.prototype.connect_ws = function(options){
         };
 	}.bind(this);
 };
+// Pass a response from the server to the request that sent the task. Returns true if the
+// response was one of the special cases (errors, notifications, etc) handled by the
+// request or the websocket
+Toyz.Core.Websocket.prototype.rx_response = function(request, result){
+    // Special cases of responses from the server
+    var responses = {
+        ERROR: 'rx_error',
+        notification: 'notify',
+        warning: 'warning',
+        initialize: 'init_ws'
+    };
+    for(var response in responses){
+        if(result.id==response){
+            var exit;
+            if(request.hasOwnProperty(response)){
+                exit = request[response](result);
+            }else{
+                exit = this[responses[response]](result);
+            };
+            if(exit){
+                return true;
+            };
+        };
+    };
+    if(request.hasOwnProperty('callback')){
+        request.callback(result);
+    }else{
+        this.rx_action(result);
+    };
+    return false;
+};
+// Send several tasks to the server in a single message. Each request in ``requests`` has
+// the same form as a request sent with send_task, and each response is passed to the
+// request for its task. If ``options.combine`` is true the server sends all of the
+// responses together when the last task has finished.
+Toyz.Core.Websocket.prototype.send_batch = function(requests, options){
+    options = $.extend(true, {combine: false}, options);
+    var batch = [];
+    for(var i=0; i<requests.length; i++){
+        batch.push({
+            module: requests[i].task.module,
+            task: requests[i].task.task,
+            parameters: requests[i].task.parameters
+        });
+    };
+    return this.send_task({
+        task: {
+            batch: batch,
+            combine: options.combine
+        },
+        batch: requests
+    });
+};
 Toyz.Core.Websocket.prototype.init_ws = function(result){
     this.user_id = result.user_id;
     this.session_id = result.session_id;
+    this.encoding = result.encoding || 'json';
     //console.log('session:',result);
     // Run any tasks that were waiting for the websocket to load
     for(var i=0;i<this.queue.length;i++){
@@ -406,13 +705,20 @@ Toyz.Core.FileDialog.prototype.load_directory = function(options){
             module:"toyz.web.tasks",
             task:"load_directory",
             parameters:{
-                path: options.path
+                path: options.path,
+                stream: true
             }
         },
         callback: function(result){
+            // Large directories are sent in chunks, the first one opens the dialog
             delete result.id;
-            this.update(result);
-            this.$div.dialog('open');
+            if(result.append){
+                this.folders.update(result.folders, true);
+                this.files.update(result.files, true);
+            }else{
+                this.update(result);
+                this.$div.dialog('open');
+            };
         }.bind(this)
     });
     if(options.hasOwnProperty('callback')){
@@ -457,8 +763,10 @@ Toyz.Core.FileSelect = function(div_name, file_dialog, get_path){
         }.bind(this));
     };
 };
-Toyz.Core.FileSelect.prototype.update = function(values){
-    this.$select.empty();
+Toyz.Core.FileSelect.prototype.update = function(values, append){
+    if(!append){
+        this.$select.empty();
+    };
     for(var i=0; i<values.length; i++){
         var $option = $('<option/>')
             .html(values[i])
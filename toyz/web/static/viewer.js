@@ -519,7 +519,10 @@ Toyz.Viewer.Controls = function(options){
                     y: y,
                     width: 400,
                     height: 200,
-                    scale: true
+                    scale: true,
+                    // Receive the data as a float32 typed array instead of a json list
+                    binary: true,
+                    dtype: 'float32'
                 };
                 websocket.send_task({
                     task: {
@@ -528,6 +531,9 @@ Toyz.Viewer.Controls = function(options){
                         parameters: params
                     },
                     callback: function(options, params, result){
+                        if(result.hasOwnProperty('binary')){
+                            result.data = Toyz.Viewer.get_array_rows(result);
+                        };
                         if(!this.workspace.hasOwnProperty('colorpad')){
                             this.workspace.colorpad = new Toyz.Viewer.Colorpad({
                                 img_info: params.img_info,
@@ -881,6 +887,18 @@ Toyz.Viewer.Contents.prototype.set_window = function(
     if(!(file_info===undefined)){
         var img_info = file_info.images[file_info.frame];
         var viewer = img_info.viewer;
+        // Track how fast the viewer is moving so the server can prefetch tiles ahead of it
+        var now = Date.now();
+        if(viewer.hasOwnProperty('timestamp') && now>viewer.timestamp){
+            var dt = (now-viewer.timestamp)/1000;
+            viewer.velocity = {
+                x: (viewer_left-viewer.left)/dt,
+                y: (viewer_top-viewer.top)/dt
+            };
+        }else{
+            viewer.velocity = {x: 0, y: 0};
+        };
+        viewer.timestamp = now;
         viewer.left = viewer_left;
         viewer.right = viewer.left + viewer.width;
         viewer.x_center = viewer.left + Math.round(viewer.width/2);
@@ -938,6 +956,10 @@ Toyz.Viewer.Contents.prototype.load_img = function(settings, viewer_frame){
                 }
             }
         };
+        if(!settings.file_info.hasOwnProperty('tile_transport')){
+            // Receive tiles over the websocket instead of saving them in the session
+            settings.file_info.tile_transport = 'websocket';
+        };
         websocket.send_task({
             task: {
                 module: 'toyz.web.tasks',
@@ -1057,23 +1079,31 @@ Toyz.Viewer.Contents.prototype.get_img_tiles = function(viewer_frame, file_frame
         this.$tile_div.scrollLeft(img_info.viewer.left);
     };
     
-    for(var tile_idx in tiles){
-        if(tiles.hasOwnProperty(tile_idx)){
-            //console.log('tile', tiles[tile_idx]);
-            websocket.send_task({
-                task: {
-                    module: 'toyz.web.tasks',
-                    task: 'get_img_tile',
-                    parameters: {
-                        file_info: file_info,
-                        img_info: img_info,
-                        tile_info: tiles[tile_idx]
-                    }
-                },
-                callback: this.rx_tile_info.bind(this, viewer_frame, file_frame, tile_idx)
-            });
-        }
+    if($.isEmptyObject(tiles)){
+        return;
     };
+    // All of the tiles are sent in a single job so that the server can render them in
+    // parallel. A response is received for each tile as soon as it has been created.
+    websocket.send_task({
+        task: {
+            module: 'toyz.web.tasks',
+            task: 'get_img_tiles',
+            parameters: {
+                file_info: file_info,
+                img_info: img_info,
+                new_tiles: tiles
+            }
+        },
+        callback: function(viewer_frame, file_frame, result){
+            if(result.id=='tile created'){
+                this.rx_tile_info(viewer_frame, file_frame, result.tile_idx, result);
+            }else{
+                for(var tile_idx in result.errors){
+                    console.log('error creating tile', tile_idx, result.errors[tile_idx]);
+                };
+            };
+        }.bind(this, viewer_frame, file_frame)
+    });
 };
 Toyz.Viewer.Contents.prototype.rx_tile_info = function(
         viewer_frame, file_frame, tile_idx, result){
@@ -1101,7 +1131,25 @@ Toyz.Viewer.Contents.prototype.rx_tile_info = function(
             this.frames[viewer_frame].$viewer.append($img);
             tile.loaded = true;
         }.bind(this, viewer_frame, img, img_info, tile_idx);
-        img.src = '/file'+img_info.tiles[tile_idx].new_filepath;
+        if(result.hasOwnProperty('binary')){
+            // The tile was sent over the websocket instead of saved on the server
+            var tile_format = this.frames[viewer_frame].file_info.tile_format;
+            var mime_types = {
+                jpg: 'image/jpeg',
+                tiff: 'image/tiff'
+            };
+            var mime_type = 'image/'+tile_format;
+            if(mime_types.hasOwnProperty(tile_format)){
+                mime_type = mime_types[tile_format];
+            };
+            var url = URL.createObjectURL(new Blob([result.binary], {type: mime_type}));
+            img.addEventListener('load', function(url){
+                URL.revokeObjectURL(url);
+            }.bind(null, url));
+            img.src = url;
+        }else{
+            img.src = '/file'+img_info.tiles[tile_idx].new_filepath;
+        };
         img.ondragstart = function(){return false;};
     }else{
         console.log('tile did not need to be created');
@@ -1436,6 +1484,44 @@ Toyz.Viewer.map_image=function(image, ctx, img_info){
     return image_data;
 };
 
+// Typed arrays used to read binary data sent from the server
+Toyz.Viewer.typed_arrays = {
+    int8: Int8Array,
+    uint8: Uint8Array,
+    int16: Int16Array,
+    uint16: Uint16Array,
+    int32: Int32Array,
+    uint32: Uint32Array,
+    float32: Float32Array,
+    float64: Float64Array
+};
+// Convert a 2D array sent as binary data (with its shape and dtype) into an array of rows.
+// Each row is a view into the same buffer, so no data is copied. Color images have a
+// trailing channel axis, so each pixel in a row is also a view with one value per channel
+// (the same layout as the lists sent without binary=true).
+Toyz.Viewer.get_array_rows = function(result){
+    if(result.shape.length<2 || result.shape.length>3){
+        throw Error("Expected a 2D array or color image, received shape " + result.shape);
+    };
+    var data = new Toyz.Viewer.typed_arrays[result.dtype](result.binary);
+    var height = result.shape[0];
+    var width = result.shape[1];
+    var channels = result.shape.length==3 ? result.shape[2] : 1;
+    var rows = [];
+    for(var i=0; i<height; i++){
+        var row = data.subarray(i*width*channels, (i+1)*width*channels);
+        if(result.shape.length==3){
+            var pixels = [];
+            for(var j=0; j<width; j++){
+                pixels.push(row.subarray(j*channels, (j+1)*channels));
+            };
+            row = pixels;
+        };
+        rows.push(row);
+    };
+    return rows;
+};
+
 Toyz.Viewer.Colorbar = function(options){
     this.type = 'custom';
     if(!options.hasOwnProperty('img_info')){
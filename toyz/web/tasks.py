@@ -9,6 +9,7 @@ While each toy may contain a large number of functions, only the functions locat
 from __future__ import print_function, division
 import importlib
 import os
+import fnmatch
 
 from toyz.utils import core
 from toyz.utils import file_access
@@ -17,6 +18,12 @@ from toyz.utils.errors import ToyzJobError
 from toyz.web import session_vars
 import six
 
+# Types of entries in a directory listing, in the order they are sorted
+directory_types = ['folder', 'file']
+
+# Default number of folders and files sent in each chunk of a streamed directory listing
+DIRECTORY_CHUNK_SIZE = 500
+
 def load_user_settings(toyz_settings, tid, params):
     """
     Load settings for a given user
@@ -174,6 +181,8 @@ def save_user_info(toyz_settings, tid, params):
             field_dict = {field: params[field]}
             field_dict.update(user)
             db_utils.update_all_params(toyz_settings.db, field, **field_dict)
+    # Any modules or toyz cached with the old permissions need to be reloaded
+    core.update_app('user_settings')
     
     if 'user_id' in user:
         msg = params['user_id']
@@ -215,6 +224,7 @@ def update_toyz_settings(toyz_settings, tid, params):
     toyz_settings.web = core.ToyzClass(web)
     toyz_settings.security = core.ToyzClass(security)
     toyz_settings.save_settings()
+    core.update_app('toyz_settings')
     
     response = {
         'id': 'notification',
@@ -254,6 +264,8 @@ def add_new_user(toyz_settings, tid, params):
         msg = 'User added correctly'
     else:
         msg = 'Group added correctly'
+    # The groups of the 'all' group's members have changed
+    core.update_app('user_settings')
     
     response = {
         'id': 'notification',
@@ -335,6 +347,16 @@ def load_directory(toyz_settings, tid, params):
     
     Params
         - path (*string* ): Path to search
+        - show_hidden (*bool*, optional): Whether or not to include hidden files
+        - prefix (*string*, optional): Only include names that start with ``prefix``
+        - pattern (*string*, optional): Only include names that match a glob pattern
+          (for example ``'*.fits'`` )
+        - limit (*int*, optional): Maximum number of folders and files to return
+        - cursor (*list*, optional): ``next_cursor`` from the previous page of the listing.
+          Only folders and files after the cursor are returned
+        - stream (*bool*, optional): Send the folders and files in chunks of 
+          ``chunk_size`` as soon as they are ready. Only jobs that can send more than 
+          one response (see :py:func:`toyz.utils.core.send_response` ) are streamed
     
     Response
         - id: 'directory'
@@ -343,6 +365,11 @@ def load_directory(toyz_settings, tid, params):
         - folders (*list* of strings): folders contained in the path
         - files (*list* of strings): files contained in the path
         - parent (*string* ): parent directory of current path
+        - total (*int* ): Number of folders and files that match the filters
+        - next_cursor (*list* ): Cursor for the next page of the listing, or **None** if 
+          there are no more folders or files
+        - append (*bool* ): Whether the folders and files should be added to the ones
+          already sent (in a ``'directory chunk'`` response with the same format)
     """
     core.check4keys(params,['path'])
     show_hidden=False
@@ -364,43 +391,59 @@ def load_directory(toyz_settings, tid, params):
     if 'show_hidden' in params and params['show_hidden']:
         show_hidden=True
     
-    # Keep separate lists of the files and directories for the current path.
+    # Only include the files and directories that match the filters
+    entries = [entry for entry in file_access.scan_directory(params['path'])
+        if (entry[0][0]!='.' or show_hidden) and 
+            entry[0].startswith(params.get('prefix', '')) and
+            ('pattern' not in params or fnmatch.fnmatch(entry[0], params['pattern']))]
     # Only include the files and directories the user has permissions to view
-    files = []
-    folders = []
     groups = db_utils.get_param(toyz_settings.db, 'groups', user_id=tid['user_id'])
-    if 'admin' in groups or tid['user_id'] == 'admin':
-        admin=True
-    else:
-        admin=False
-    for f in os.listdir(params['path']):
-        if(f[0]!='.' or show_hidden):
-            f_path =os.path.join(params['path'],f)
-            if admin:
-                permission = True
-            else:
-                permissions = file_access.get_parent_permissions(toyz_settings.db,
-                    f_path, user_id=tid['user_id'])
-                if permissions is None:
-                    permissions = ''
-                permission = 'f' in permissions
-            if permission:
-                if os.path.isfile(f_path):
-                    files.append(str(f))
-                elif os.path.isdir(f_path):
-                    folders.append(str(f))
-            else:
-                print("no access to", f)
-    files.sort(key=lambda v: v.lower())
-    folders.sort(key=lambda v: v.lower())
+    if 'admin' not in groups and tid['user_id'] != 'admin':
+        # Find the permissions of every entry at once
+        all_permissions = file_access.get_directory_permissions(toyz_settings.db,
+            params['path'], [entry[0] for entry in entries], user_id=tid['user_id'])
+        entries = [entry for entry in entries 
+            if 'f' in (all_permissions[entry[0]] or '')]
+    
+    # Folders are listed before files, and each is sorted alphabetically
+    entries = [(0, str(f)) for f, is_file, is_dir in entries if is_dir]+[
+        (1, str(f)) for f, is_file, is_dir in entries if is_file and not is_dir]
+    entries.sort(key=lambda entry: (entry[0], entry[1].lower(), entry[1]))
+    total = len(entries)
+    
+    # Only return the entries after the cursor
+    if params.get('cursor') is not None:
+        cursor = (directory_types.index(params['cursor'][0]), params['cursor'][1])
+        cursor = (cursor[0], cursor[1].lower(), cursor[1])
+        entries = [entry for entry in entries if (entry[0], entry[1].lower(), entry[1])>cursor]
+    next_cursor = None
+    if params.get('limit') is not None and len(entries)>int(params['limit']):
+        entries = entries[:int(params['limit'])]
+        next_cursor = [directory_types[entries[-1][0]], entries[-1][1]]
+    
     response={
         'id': 'directory',
         'path': os.path.join(params['path'],''),
         'shortcuts': shortcuts.keys(),
-        'folders': folders,
-        'files': files,
-        'parent': os.path.abspath(os.path.join(params['path'],os.pardir))
+        'folders': [],
+        'files': [],
+        'parent': os.path.abspath(os.path.join(params['path'],os.pardir)),
+        'total': total,
+        'next_cursor': next_cursor,
+        'append': False
     }
+    # Send the entries to the client in chunks as they are ready (if the executor allows it)
+    if params.get('stream', False) and core.get_job_pipe() is not None:
+        chunk_size = int(params.get('chunk_size', DIRECTORY_CHUNK_SIZE))
+        while len(entries)>chunk_size:
+            chunk = dict(response, id='directory chunk')
+            chunk['folders'] = [f for t, f in entries[:chunk_size] if t==0]
+            chunk['files'] = [f for t, f in entries[:chunk_size] if t==1]
+            core.send_response(tid, chunk)
+            entries = entries[chunk_size:]
+            response['append'] = True
+    response['folders'] = [f for t, f in entries if t==0]
+    response['files'] = [f for t, f in entries if t==1]
     
     #print('path info:', response)
     return response
@@ -505,6 +548,7 @@ def load_data_file(toyz_settings, tid, params):
     toyz_module = params['paths']['data']['toyz_module']
     
     module_info = core.get_module_info(toyz_settings, tid, params)
+    time_info = time.time()
     session_vars.data_sources[src_id] = module_info['data_sources'][toyz_module][src_type](
         module_info, user_id=tid['user_id'], paths=params['paths'])
     session_vars.data_sources[src_id].src_id = src_id
@@ -516,7 +560,12 @@ def load_data_file(toyz_settings, tid, params):
         'id': 'data_file',
         'columns': session_vars.data_sources[src_id].columns,
         'benchmark': {
-            'load_time': time2-time1
+            'load_time': time2-time1,
+            'module_info_time': time_info-time1,
+            'module_info_cached': module_info['benchmark']['cached'],
+            'module_info_db_time': module_info['benchmark']['db_time'],
+            'module_info_import_time': module_info['benchmark']['import_time'],
+            'src_time': time2-time_info
         }
     }
     return response
@@ -773,7 +822,10 @@ def get_img_info(toyz_settings, tid, params):
 
 def get_tile_info(toyz_settings, tid, params):
     """
-    Get new tiles that need to be loaded
+    Get new tiles that need to be loaded. This also updates the viewport for the image,
+    so jobs to create tiles that are no longer in view are dropped. Since it is a
+    priority task (see :py:data:`toyz.utils.core.priority_tasks` ) it is run as soon as it
+    is received, even if the session is busy creating tiles.
     """
     import toyz.web.viewer as viewer
     
@@ -787,6 +839,7 @@ def get_tile_info(toyz_settings, tid, params):
                 'Please contact your network administrator if you believe this is an error.')
     
     all_tiles, new_tiles = viewer.get_tile_info(params['file_info'], params['img_info'])
+    viewer.set_viewport(params['file_info'], params['img_info'])
     
     #print('all tile:', all_tiles)
     
@@ -802,6 +855,7 @@ def get_img_tile(toyz_settings, tid, params):
     Load a tile from a larger image and notify the client it has been created
     """
     import toyz.web.viewer as viewer
+    from toyz.web import tile_cache as cache_utils
     
     core.check4keys(params, ['img_info', 'file_info', 'tile_info'])
     if tid['user_id']!='admin':
@@ -812,17 +866,101 @@ def get_img_tile(toyz_settings, tid, params):
                 'You do not have permission to view the requested file.'
                 'Please contact your network administrator if you believe this is an error.')
     
+    # The viewer may have moved since the job was sent
+    if not viewer.tile_in_viewport(
+            params['file_info'], params['img_info'], params['tile_info']):
+        return {
+            'id': 'tile created',
+            'success': False,
+            'cancelled': True,
+            'tile_info': params['tile_info']
+        }
+    
+    tile_cache = cache_utils.get_tile_cache(toyz_settings)
     created, tile_info = viewer.create_tile(
-        params['file_info'], params['img_info'], params['tile_info'])
+        params['file_info'], params['img_info'], params['tile_info'], tile_cache)
     
     response = {
         'id': 'tile created',
         'success': created,
         'tile_info': tile_info
     }
+    # Tiles encoded in memory are sent to the client as a binary message
+    if created and 'tile_data' in tile_info:
+        response['binary'] = tile_info.pop('tile_data')
     
     return response
 
+def get_img_tiles(toyz_settings, tid, params):
+    """
+    Create a batch of tiles in parallel (see :py:func:`toyz.web.viewer.create_tiles` )
+    and notify the client as each tile is created.
+    
+    Params
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame
+        - new_tiles (*dict* ): Tiles to create (see :py:func:`toyz.web.tasks.get_tile_info` )
+    
+    Response
+        A response is sent for each tile as soon as it has been created (or skipped
+        because it is no longer in the viewport)
+            - id: 'tile created'
+            - success (*bool* ): Whether or not the tile was created
+            - tile_idx (*string* ): Index of the tile
+            - tile_info (*dict* ): Info for the new tile
+            - error (*string*, optional): Traceback of the error if the tile could not be
+              created
+        and when all of the tiles have been created the job returns
+            - id: 'tiles created'
+            - finished: True
+            - errors (*dict* ): Errors for any tiles that could not be created
+    """
+    import toyz.web.viewer as viewer
+    from toyz.web import tile_cache as cache_utils
+    
+    core.check4keys(params, ['img_info', 'file_info', 'new_tiles'])
+    if tid['user_id']!='admin':
+        permissions = file_access.get_parent_permissions(
+            toyz_settings.db, params['file_info']['filepath'], user_id=tid['user_id'])
+        if permissions is None or 'r' not in permissions:
+            raise ToyzJobError(
+                'You do not have permission to view the requested file.'
+                'Please contact your network administrator if you believe this is an error.')
+    
+    tile_cache = cache_utils.get_tile_cache(toyz_settings)
+    # By default a session can use every process in the shared pool
+    processes = getattr(toyz_settings.web, 'tile_processes', None)
+    if processes is None:
+        processes = getattr(toyz_settings.web, 'job_processes', None)
+    errors = {}
+    for tile_idx, created, tile_info, error in viewer.create_tiles(params['file_info'], 
+            params['img_info'], params['new_tiles'], tile_cache, processes):
+        response = {
+            'id': 'tile created',
+            'success': created,
+            'tile_idx': tile_idx,
+            'tile_info': tile_info
+        }
+        if error is not None:
+            errors[tile_idx] = error
+            response['error'] = error
+        # Tiles encoded in memory are sent to the client as a binary message
+        if created and 'tile_data' in tile_info:
+            response['binary'] = tile_info.pop('tile_data')
+        core.send_response(tid, response)
+        # Update the viewport if the client has moved the viewer, so that the remaining
+        # tiles that are no longer needed are skipped, and stop if the client cancelled
+        # the job
+        if core.job_cancelled(tid):
+            break
+    
+    response = {
+        'id': 'tiles created',
+        'finished': True,
+        'errors': errors
+    }
+    return response
+
 def get_img_data(toyz_settings, tid, params):
     """
     Get data from an image or FITS file
@@ -834,6 +972,40 @@ def get_img_data(toyz_settings, tid, params):
     #print('response:', response)
     return response
 
+def get_img_histogram(toyz_settings, tid, params):
+    """
+    Get the histogram of an image frame or a region in the frame. Histograms are cached,
+    so the client can request them whenever the colormap is changed.
+    
+    Params
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame
+        - bins (*int*, optional): Number of bins (default is 256)
+        - log (*bool*, optional): Whether or not to use logarithmic bins
+        - px_range (*list*, optional): ``[px_min, px_max]`` range of the histogram (by
+          default the range of the pixels)
+        - region (*dict*, optional): ``x0``, ``y0``, ``xf``, ``yf`` bounds of a region in
+          the frame (by default the entire frame is used)
+    
+    Response
+        - id: 'histogram'
+        - counts (*list* ): Number of pixels in each bin
+        - edges (*list* ): Edges of the bins
+    """
+    import toyz.web.viewer as viewer
+    core.check4keys(params, ['file_info', 'img_info'])
+    if tid['user_id']!='admin':
+        permissions = file_access.get_parent_permissions(
+            toyz_settings.db, params['file_info']['filepath'], user_id=tid['user_id'])
+        if permissions is None or 'r' not in permissions:
+            raise ToyzJobError(
+                'You do not have permission to view the requested file.'
+                'Please contact your network administrator if you believe this is an error.')
+    
+    kwargs = {k: params[k] for k in ['bins', 'log', 'px_range', 'region'] if k in params}
+    response = viewer.get_img_histogram(params['file_info'], params['img_info'], **kwargs)
+    return response
+
 def log_benchmark(toyz_settings, tid, params):
     """
     Log benchmark information
@@ -0,0 +1,168 @@
+# Copyright 2015 by Fred Moolekamp
+# License: BSD 3-clause
+"""
+Server-wide cache of image tiles shared by all sessions and users.
+
+Tiles are stored under a key built from everything that affects how a tile looks
+(file path and modification time, frame, scale, colormap, bounds and format), so identical
+tiles are only rendered once no matter how many users view the same image. The cache is
+never served to the client directly: when a job needs a tile it is either linked (or
+copied) into the session's temp directory, so the browser still loads it through the
+normal file permissions of the user, or read and sent over the websocket. In both cases
+the task that requested the tile has already checked that the user has permission to
+read the original image.
+"""
+from __future__ import print_function, division
+import os
+import json
+import shutil
+import hashlib
+
+from toyz.utils import core
+
+# Default maximum size of the tile cache (in MB) if one is not set in the web settings
+DEFAULT_CACHE_SIZE = 1024
+
+# Number of bytes written to the cache by the current process since the size of the
+# cache was last checked
+_bytes_written = 0
+
+def get_tile_cache(toyz_settings):
+    """
+    Get the location and maximum size of the tile cache for the application.
+
+    Parameters
+        - toyz_settings ( :py:class:`toyz.utils.core.ToyzSettings`): Settings for the toyz
+          application
+
+    Returns
+        - tile_cache (*dict* ): Dictionary with the ``path`` of the cache and its
+          ``max_size`` in bytes, or **None** if the cache has been disabled (by setting
+          ``web.tile_cache_size`` to zero)
+    """
+    cache_size = getattr(toyz_settings.web, 'tile_cache_size', DEFAULT_CACHE_SIZE)
+    if not cache_size:
+        return None
+    return {
+        'path': os.path.join(toyz_settings.config.root_path, 'cache', 'tiles'),
+        'max_size': int(cache_size*1024*1024)
+    }
+
+def get_tile_key(file_info, img_info, tile_info):
+    """
+    Get the unique key for a tile. Any change to the image file on disk changes its
+    modification time, so old tiles are never loaded for a modified image.
+    """
+    colormap = img_info['colormap']
+    key_params = [
+        file_info['filepath'],
+        os.path.getmtime(file_info['filepath']),
+        str(img_info['frame']),
+        "{0:.6f}".format(img_info['scale']),
+        colormap['name'],
+        colormap.get('color_scale', 'linear'),
+        bool(colormap['invert_color']),
+        "{0:.6g}".format(colormap['px_min']),
+        "{0:.6g}".format(colormap['px_max']),
+        tile_info['x0_idx'], tile_info['xf_idx'], tile_info['y0_idx'], tile_info['yf_idx'],
+        tile_info['width'], tile_info['height'],
+        bool(img_info['invert_x']),
+        bool(img_info['invert_y']),
+        file_info['resampling'],
+        file_info['tile_format']
+    ]
+    return hashlib.sha1(json.dumps(key_params).encode('utf-8')).hexdigest()
+
+def get_cache_filepath(tile_cache, key, tile_format):
+    """
+    Path to a tile in the cache. Tiles are split into sub directories by the first two
+    characters of their key to keep the number of files in a single directory small.
+    """
+    return os.path.join(tile_cache['path'], key[:2], key+'.'+tile_format)
+
+def link_tile(cache_filepath, filepath):
+    """
+    Make a tile in the cache available at ``filepath``. A hard link is used when
+    possible, otherwise the tile is copied.
+    """
+    core.create_paths([os.path.dirname(filepath)])
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    try:
+        os.link(cache_filepath, filepath)
+    except (OSError, AttributeError):
+        shutil.copyfile(cache_filepath, filepath)
+
+def load_tile(tile_cache, key, tile_format):
+    """
+    Get the path to a tile in the cache, or **None** if it has not been cached. The
+    modification time of a tile is updated each time it is loaded, which is used to
+    remove the least recently used tiles when the cache is full.
+    """
+    cache_filepath = get_cache_filepath(tile_cache, key, tile_format)
+    try:
+        os.utime(cache_filepath, None)
+    except OSError:
+        return None
+    return cache_filepath
+
+def read_tile(cache_filepath):
+    """
+    Read an encoded tile from the cache.
+    """
+    with open(cache_filepath, 'rb') as f:
+        tile_data = f.read()
+    return tile_data
+
+def save_tile(tile_cache, key, tile_data, tile_format):
+    """
+    Save an encoded tile to the cache. The tile is written to a temporary file first so
+    that other processes never load a partially written tile.
+
+    Returns
+        - cache_filepath (*string* ): Path to the tile in the cache
+    """
+    global _bytes_written
+    cache_filepath = get_cache_filepath(tile_cache, key, tile_format)
+    core.create_paths([os.path.dirname(cache_filepath)])
+    temp_filepath = '{0}.{1}.tmp'.format(cache_filepath, os.getpid())
+    with open(temp_filepath, 'wb') as f:
+        f.write(tile_data)
+    os.rename(temp_filepath, cache_filepath)
+
+    # Only check the size of the cache after a fraction of it has been written,
+    # since walking the cache directory is expensive
+    _bytes_written += len(tile_data)
+    if _bytes_written > tile_cache['max_size']/20:
+        _bytes_written = 0
+        evict_tiles(tile_cache)
+    return cache_filepath
+
+def evict_tiles(tile_cache):
+    """
+    If the cache is larger than its maximum size, remove the least recently used tiles
+    until it is 90% full.
+    """
+    tiles = []
+    total_size = 0
+    for path, dirs, files in os.walk(tile_cache['path']):
+        for f in files:
+            filepath = os.path.join(path, f)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                # Another process removed the tile
+                continue
+            tiles.append((stat.st_mtime, stat.st_size, filepath))
+            total_size += stat.st_size
+    if total_size <= tile_cache['max_size']:
+        return
+    tiles.sort()
+    for mtime, size, filepath in tiles:
+        if total_size <= .9*tile_cache['max_size']:
+            break
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+        total_size -= size
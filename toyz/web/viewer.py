@@ -5,19 +5,39 @@ from collections import OrderedDict
 from toyz.utils.errors import ToyzJobError
 import math
 import os
+import warnings
 import numpy as np
 from toyz.utils import core
 from toyz.web import session_vars
+from toyz.web import tile_cache as cache_utils
+from toyz.web import colormaps
+from toyz.web import region_stats
 
 # Set the default values for the sessions global variables if they have not already been set
 viewer_variables = {
-    'filepath': None,
-    'img_file': None,
+    'img_files': OrderedDict(),
+    'pyramids': OrderedDict(),
+    'viewports': {},
+    'bounds': {}
 }
 for v in viewer_variables:
     if not hasattr(session_vars, v):
         setattr(session_vars, v, viewer_variables[v])
 
+# Maximum number of image files a session keeps open at the same time
+MAX_OPEN_FILES = 4
+
+# Maximum memory (in bytes) each process uses to store the downsampled levels of image
+# pyramids, after which the levels of the least recently used images are removed
+MAX_PYRAMID_BYTES = 512*2**20
+
+# Number of tiles loaded around the edge of the viewer before they are visible
+PREFETCH_TILES = 1
+# Tiles that will be visible within this many seconds (based on the current velocity of
+# the viewer) are also loaded, up to a maximum of MAX_PREFETCH_TILES in each direction
+PREFETCH_TIME = .5
+MAX_PREFETCH_TILES = 4
+
 # It may be desirabe in the future to allow users to choose what type of image they
 # want to send to the client. For now the default is sent to jpg, since it is the
 # smallest image type.
@@ -40,6 +60,20 @@ img_formats = {
     'xbm': 'XBM'
 }
 
+# Resampling modes for FITS images that downsample the data by combining each block of
+# pixels into a single pixel, instead of one of the PIL resampling filters. NaN pixels
+# are ignored, so a single bad pixel does not blank its whole block.
+block_reduce_modes = {
+    'MEAN': np.nanmean,
+    'MEDIAN': np.nanmedian,
+    'MAX': np.nanmax,
+    'SUM': np.nansum
+}
+
+# Number of rows of a memory mapped image combined at a time when a level of a binned
+# pyramid is built (this must be even)
+BLOCK_REDUCE_ROWS = 512
+
 def import_fits():
     try:
         import astropy.io.fits as pyfits
@@ -51,19 +85,49 @@ def import_fits():
                 "You must have astropy or pyfits installed to view FITS images")
     return pyfits
 
+def close_file(filepath):
+    """
+    Close an image file opened by :py:func:`toyz.web.viewer.get_file` and remove any
+    pyramids, bounds, integral images and histograms built from it. This is also called
+    when the least recently used file is evicted from ``session_vars.img_files`` .
+    """
+    img_file = session_vars.img_files.pop(filepath)['img_file']
+    for key in list(session_vars.pyramids.keys()):
+        if key[0]==filepath:
+            del session_vars.pyramids[key]
+    for key in list(session_vars.bounds.keys()):
+        if key[0]==filepath:
+            del session_vars.bounds[key]
+    region_stats.clear_cache(filepath)
+    if hasattr(img_file, 'close'):
+        img_file.close()
+
 def get_file(file_info):
     """
     If the image has already been loaded into memory, access it here.
-    Otherwise, store the image for later use
+    Otherwise, store the image for later use.
+    
+    Up to ``MAX_OPEN_FILES`` files are kept open in ``session_vars.img_files`` so that
+    a session can switch between images without reloading them, after which the least
+    recently used file is closed. A file is reloaded if it has been modified since it was
+    opened. FITS files are memory mapped, so only the parts of an image that are
+    actually used (for example the rows needed to create a tile) are read from disk.
     """
-    if session_vars.filepath == file_info['filepath']:
-        img_file = session_vars.img_file
+    filepath = file_info['filepath']
+    mtime = os.path.getmtime(filepath)
+    img_files = session_vars.img_files
+    if filepath in img_files and img_files[filepath]['mtime']==mtime:
+        # Move the file to the end of the queue so that it is closed last
+        img_files[filepath] = img_files.pop(filepath)
+        img_file = img_files[filepath]['img_file']
     else:
-        print('loading', file_info['filepath'])
+        if filepath in img_files:
+            close_file(filepath)
+        print('loading', filepath)
         if file_info['ext']=='fits':
             print('Detected fits image type')
             pyfits = import_fits()
-            img_file = pyfits.open(file_info['filepath'])
+            img_file = pyfits.open(filepath, memmap=True)
         else:
             try:
                 from PIL import Image
@@ -72,11 +136,151 @@ def get_file(file_info):
                     "You must have PIL (Python Imaging Library) installed to "
                     "open files of this type"
                 )
-            img_file = Image.open(file_info['filepath'])
-        session_vars.filepath = file_info['filepath']
-        session_vars.img_file = img_file
+            img_file = Image.open(filepath)
+        img_files[filepath] = {
+            'img_file': img_file,
+            'mtime': mtime
+        }
+        while len(img_files)>MAX_OPEN_FILES:
+            close_file(next(iter(img_files)))
     return img_file
 
+def get_pyramid_level(scale):
+    """
+    Get the level of the image pyramid used to create tiles at a given ``scale``. Level
+    ``n`` of the pyramid is downsampled by a factor of ``2**n`` from the full resolution
+    image, and the level chosen is the smallest image that is still at least as large as
+    the scaled image (so the remaining scale factor is always in the range (0.5,1]).
+    """
+    if scale>=1:
+        return 0
+    # Add a small tolerance so that exact powers of two are not lost to rounding errors
+    return int(math.floor(math.log(1/scale, 2)+1e-9))
+
+def get_pyramid(file_info, img_info, level, mode=None):
+    """
+    Get a downsampled level of the image pyramid for the current frame. Levels are built
+    lazily (each one from the level above it) the first time they are needed and stored in
+    ``session_vars.pyramids`` until the file is closed or modified, or the pyramids use
+    more than ``MAX_PYRAMID_BYTES`` (see :py:func:`toyz.web.viewer.trim_pyramids` ).
+    
+    For FITS images each downsampled level is copied into a contiguous array, so the
+    memory mapped file is only read once to build it and tiles are cropped from memory.
+    
+    Parameters
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame
+        - level (*int* ): Level of the pyramid to load
+        - mode (*string*, optional): One of the ``block_reduce_modes`` (see
+          :py:func:`toyz.web.viewer.get_pyramid_mode` ). If this is given each level
+          combines every 2x2 block of pixels in the level above it
+          (see :py:func:`toyz.web.viewer.block_reduce` ) instead of keeping every other
+          pixel, and is stored separately from the pyramids for other modes. PIL images
+          always use the mean of each block (a box filter) when a mode is given.
+    
+    Returns
+        - level (*int* ): Level of the pyramid that was loaded. This will be smaller than
+          the requested level if the image cannot be downsampled any further.
+        - data (*numpy array* or *PIL Image* ): The downsampled FITS data or image
+    """
+    # Load the file first, in case it has been modified and the pyramid needs to be rebuilt
+    img_file = get_file(file_info)
+    key = (file_info['filepath'], str(img_info['frame']))
+    if mode is not None:
+        key += (mode,)
+    if key in session_vars.pyramids:
+        # Move the pyramid to the end of the queue so that it is trimmed last
+        session_vars.pyramids[key] = session_vars.pyramids.pop(key)
+    elif file_info['ext']=='fits':
+        session_vars.pyramids[key] = [img_file[int(img_info['frame'])].data]
+    else:
+        session_vars.pyramids[key] = [img_file]
+    pyramid = session_vars.pyramids[key]
+    if len(pyramid)<=level:
+        while len(pyramid)<=level:
+            last_level = pyramid[-1]
+            if file_info['ext']=='fits':
+                if min(last_level.shape)<2:
+                    break
+                if mode is None:
+                    pyramid.append(np.ascontiguousarray(last_level[::2,::2]))
+                else:
+                    # Only copy a strip of the level above at a time, since the full
+                    # resolution level is memory mapped
+                    pyramid.append(np.concatenate([
+                        block_reduce(last_level[y:y+BLOCK_REDUCE_ROWS], 2, mode)
+                        for y in range(0, last_level.shape[0], BLOCK_REDUCE_ROWS)]))
+            else:
+                from PIL import Image
+                width, height = last_level.size
+                if min(width, height)<2:
+                    break
+                if mode is None:
+                    resampling = Image.NEAREST
+                else:
+                    resampling = getattr(Image, 'BOX', Image.BILINEAR)
+                pyramid.append(last_level.resize((width//2, height//2), resampling))
+        trim_pyramids(key)
+    level = min(level, len(pyramid)-1)
+    return level, pyramid[level]
+
+def get_pyramid_mode(resampling):
+    """
+    Mode of the pyramid used for a resampling filter (see
+    :py:func:`toyz.web.viewer.get_pyramid` ). Only ``NEAREST`` uses levels that keep every
+    other pixel. The binning modes combine blocks with the same function, and the PIL
+    smoothing filters use the mean of each block, so single pixel sources are not dropped
+    before the filter is applied.
+    """
+    if resampling == 'NEAREST':
+        return None
+    if resampling in block_reduce_modes:
+        return resampling
+    return 'MEAN'
+
+def get_level_size(data):
+    """
+    Memory (in bytes) used by a level of a pyramid
+    """
+    if hasattr(data, 'nbytes'):
+        return data.nbytes
+    width, height = data.size
+    return width*height*len(data.getbands())
+
+def trim_pyramids(current_key):
+    """
+    Remove the downsampled levels of the least recently used pyramids until the pyramids
+    use less than ``MAX_PYRAMID_BYTES``. The full resolution level is the image file
+    itself, so it is never counted or removed, and neither is the pyramid with key
+    ``current_key`` (the one that is currently being used).
+    """
+    sizes = OrderedDict([(key, sum([get_level_size(data) for data in pyramid[1:]]))
+        for key, pyramid in session_vars.pyramids.items()])
+    total = sum(sizes.values())
+    for key, size in sizes.items():
+        if total<=MAX_PYRAMID_BYTES:
+            break
+        if key!=current_key and size>0:
+            del session_vars.pyramids[key][1:]
+            total -= size
+
+def get_level_info(img_info, tile_info, level, width, height):
+    """
+    Convert the image and tile information from full resolution coordinates to the
+    coordinates of a pyramid level with dimensions ``width`` x ``height``.
+    """
+    factor = 2**level
+    level_img_info = dict(img_info)
+    level_img_info['scale'] = img_info['scale']*factor
+    level_img_info['width'] = width
+    level_img_info['height'] = height
+    level_tile_info = dict(tile_info)
+    level_tile_info['x0_idx'] = tile_info['x0_idx']//factor
+    level_tile_info['y0_idx'] = tile_info['y0_idx']//factor
+    level_tile_info['xf_idx'] = min(int(math.ceil(tile_info['xf_idx']/factor)), width)
+    level_tile_info['yf_idx'] = min(int(math.ceil(tile_info['yf_idx']/factor)), height)
+    return level_img_info, level_tile_info
+
 def get_file_info(file_info):
     file_split = file_info['filepath'].split('.')
     file_info['filename'] = os.path.basename(file_split[0])
@@ -117,11 +321,15 @@ def get_file_info(file_info):
         'invert_x': False,
         'invert_y': False,
         'tile_format': 'png',
+        'tile_transport': 'file',
+        'prefetch_tiles': PREFETCH_TILES,
         'colormap': {
             'name': 'Spectral',
             'color_scale': 'linear',
             'invert_color': False,
-            'set_bounds': False
+            'set_bounds': False,
+            'auto_bounds': 'zscale',
+            'percentile': 99.5
         }
     }
     
@@ -151,6 +359,21 @@ def get_best_fit(data_width, data_height, img_viewer):
     img_viewer = get_window(img_viewer)
     return img_viewer
 
+def get_bounds(file_info, img_info, data):
+    """
+    Get the default bounds of the colormap for an image frame using the ``auto_bounds``
+    method of the colormap (see :py:func:`toyz.web.colormaps.get_bounds` ). The bounds
+    are stored in ``session_vars.bounds`` until the file is closed, so they are only 
+    calculated once for each frame.
+    """
+    colormap = img_info['colormap']
+    method = colormap.get('auto_bounds', 'zscale')
+    percentile = colormap.get('percentile', 99.5)
+    key = (file_info['filepath'], str(img_info['frame']), method, percentile)
+    if key not in session_vars.bounds:
+        session_vars.bounds[key] = colormaps.get_bounds(data, method, percentile)
+    return session_vars.bounds[key]
+
 def get_img_info(file_info, img_info):
     if file_info['ext']=='fits':
         hdulist = get_file(file_info)
@@ -158,16 +381,11 @@ def get_img_info(file_info, img_info):
         height, width = data.shape
         
         if('colormap' not in img_info):
-            if(file_info['colormap']['set_bounds']):
-                px_min = file_info['px_min']
-                px_max = file_info['px_max']
-            else:
-                px_min = float(data.min())
-                px_max = float(data.max())
-            img_info['colormap'] = file_info['colormap']
+            img_info['colormap'] = dict(file_info['colormap'])
             if not file_info['colormap']['set_bounds']:
-                img_info['colormap']['px_min'] = float(data.min())
-                img_info['colormap']['px_max'] = float(data.max())
+                px_min, px_max = get_bounds(file_info, img_info, data)
+                img_info['colormap']['px_min'] = px_min
+                img_info['colormap']['px_max'] = px_max
     else:
         # For non-FITS formats, only a single large image is loaded, which 
         try:
@@ -229,39 +447,88 @@ def get_tile_filename(file_info, img_info, x0_idx, xf_idx, y0_idx, yf_idx):
     new_filepath = os.path.join(img_info['save_path'], new_filename+'.'+file_info['tile_format'])
     return new_filepath
 
-def get_tile_info(file_info, img_info):
+def get_tile_bounds(file_info, img_info, prefetch=0):
     """
-    Get info for all tiles available in the viewer. If the tile has not been loaded yet,
-    it is added to the new_tiles array.
+    Get the range of columns and rows of tiles that cover the viewer.
+    
+    Parameters
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame, including the ``viewer``
+        - prefetch (*int*, optional): Number of extra tiles to include around the edges of
+          the viewer. If the viewer has a ``velocity`` (in pixels/second), tiles that will
+          be visible in the next ``PREFETCH_TIME`` seconds are also included.
+    
+    Returns
+        - bounds (*dict* ): ``min_col``, ``max_col``, ``min_row`` and ``max_row`` of the
+          tiles (the max values are not included in the range)
     """
-    all_tiles = []
-    new_tiles = {}
+    viewer = img_info['viewer']
+    velocity = viewer.get('velocity', {'x': 0, 'y': 0})
+    vx = velocity['x']
+    vy = velocity['y']
     if img_info['invert_x']:
-        xmin = img_info['width']*img_info['scale'] - img_info['viewer']['right']
-        xmax = img_info['width']*img_info['scale'] - img_info['viewer']['left']
+        xmin = img_info['width']*img_info['scale'] - viewer['right']
+        xmax = img_info['width']*img_info['scale'] - viewer['left']
+        vx = -vx
     else:
-        xmin = img_info['viewer']['left']
-        xmax = img_info['viewer']['right']
+        xmin = viewer['left']
+        xmax = viewer['right']
     if img_info['invert_y']:
-        ymin = img_info['height']*img_info['scale'] - img_info['viewer']['bottom']
-        ymax = img_info['height']*img_info['scale'] - img_info['viewer']['top']
+        ymin = img_info['height']*img_info['scale'] - viewer['bottom']
+        ymax = img_info['height']*img_info['scale'] - viewer['top']
+        vy = -vy
     else:
-        ymin = img_info['viewer']['top']
-        ymax = img_info['viewer']['bottom']
-    minCol = int(max(1,math.floor(xmin/file_info['tile_width'])))-1
-    maxCol=int(min(img_info['columns'],math.ceil(xmax/file_info['tile_width'])))
-    minRow = int(max(1,math.floor(ymin/file_info['tile_height'])))-1
-    maxRow = int(min(img_info['rows'],math.ceil(ymax/file_info['tile_height'])))
+        ymin = viewer['top']
+        ymax = viewer['bottom']
+    
+    # Extend the viewer in the direction it is moving
+    left = right = top = bottom = prefetch
+    if prefetch>0:
+        x_ahead = min(MAX_PREFETCH_TILES, 
+            int(math.ceil(abs(vx)*PREFETCH_TIME/file_info['tile_width'])))
+        y_ahead = min(MAX_PREFETCH_TILES, 
+            int(math.ceil(abs(vy)*PREFETCH_TIME/file_info['tile_height'])))
+        if vx>0:
+            right = max(right, x_ahead)
+        elif vx<0:
+            left = max(left, x_ahead)
+        if vy>0:
+            bottom = max(bottom, y_ahead)
+        elif vy<0:
+            top = max(top, y_ahead)
+    
+    return {
+        'min_col': int(max(1,math.floor(xmin/file_info['tile_width'])-left))-1,
+        'max_col': int(min(img_info['columns'],
+            math.ceil(xmax/file_info['tile_width'])+right)),
+        'min_row': int(max(1,math.floor(ymin/file_info['tile_height'])-top))-1,
+        'max_row': int(min(img_info['rows'],
+            math.ceil(ymax/file_info['tile_height'])+bottom))
+    }
+
+def get_tile_info(file_info, img_info):
+    """
+    Get info for all tiles available in the viewer (and the ring of tiles around it that are
+    prefetched, see :py:func:`toyz.web.viewer.get_tile_bounds` ). If the tile has not been
+    loaded yet, it is added to the new_tiles array. Tiles are given a ``priority`` , the
+    distance (in tiles) from the visible part of the image, so that visible tiles can be 
+    loaded first.
+    """
+    all_tiles = []
+    new_tiles = {}
+    visible = get_tile_bounds(file_info, img_info)
+    bounds = get_tile_bounds(file_info, img_info, 
+        file_info.get('prefetch_tiles', PREFETCH_TILES))
     
     block_width = int(math.ceil(file_info['tile_width']/img_info['scale']))
     block_height = int(math.ceil(file_info['tile_height']/img_info['scale']))
     
-    for row in range(minRow,maxRow):
+    for row in range(bounds['min_row'], bounds['max_row']):
         y0 = row*file_info['tile_height']
         yf = (row+1)*file_info['tile_height']
         y0_idx = int(y0/img_info['scale'])
         yf_idx = min(y0_idx + block_height, img_info['height'])
-        for col in range(minCol,maxCol):
+        for col in range(bounds['min_col'], bounds['max_col']):
             all_tiles.append(str(col)+','+str(row))
             tile_idx = str(col)+','+str(row)
             if (tile_idx not in img_info['tiles'] or 
@@ -275,6 +542,9 @@ def get_tile_info(file_info, img_info):
                 tile_height = int((yf_idx-y0_idx)*img_info['scale'])
                 new_filepath = get_tile_filename(
                     file_info, img_info, x0_idx, xf_idx, y0_idx, yf_idx)
+                priority = max(
+                    visible['min_col']-col, col-visible['max_col']+1,
+                    visible['min_row']-row, row-visible['max_row']+1, 0)
                 tile = {
                     'idx': tile_idx,
                     'left': x0,
@@ -285,6 +555,7 @@ def get_tile_info(file_info, img_info):
                     'yf_idx': yf_idx,
                     'x0_idx': x0_idx,
                     'xf_idx': xf_idx,
+                    'pyramid_level': get_pyramid_level(img_info['scale']),
                     'new_filepath': new_filepath,
                     'loaded': False,
                     'row': row,
@@ -292,7 +563,8 @@ def get_tile_info(file_info, img_info):
                     'x': col*file_info['tile_width'],
                     'y': row*file_info['tile_height'],
                     'width': tile_width,
-                    'height': tile_height
+                    'height': tile_height,
+                    'priority': priority
                 }
                 if img_info['invert_y']:
                     tile['top'] = yf
@@ -305,6 +577,30 @@ def get_tile_info(file_info, img_info):
     print('new tiles', new_tiles.keys())
     return all_tiles, new_tiles
 
+def set_viewport(file_info, img_info):
+    """
+    Save the tiles currently needed by the client for an image, so that jobs to create
+    tiles that have scrolled out of view (or were made at a different scale) can be 
+    dropped (see :py:func:`toyz.web.viewer.tile_in_viewport` ).
+    """
+    bounds = get_tile_bounds(file_info, img_info, 
+        file_info.get('prefetch_tiles', PREFETCH_TILES))
+    bounds['scale'] = img_info['scale']
+    session_vars.viewports[(file_info['filepath'], str(img_info['frame']))] = bounds
+
+def tile_in_viewport(file_info, img_info, tile_info):
+    """
+    Check whether or not a tile is still needed by the client. If no viewport has been set
+    for the image the tile is always needed.
+    """
+    viewport = session_vars.viewports.get((file_info['filepath'], str(img_info['frame'])))
+    if viewport is None:
+        return True
+    if viewport['scale']!=img_info['scale']:
+        return False
+    return (viewport['min_col']<=tile_info['col']<viewport['max_col'] and
+        viewport['min_row']<=tile_info['row']<viewport['max_row'])
+
 def scale_data(file_info, img_info, tile_info, data):
     if img_info['scale']==1:
         data = data[tile_info['y0_idx']:tile_info['yf_idx'],
@@ -314,12 +610,15 @@ def scale_data(file_info, img_info, tile_info, data):
             import scipy.ndimage
             data = data[tile_info['y0_idx']:tile_info['yf_idx'],
                 tile_info['x0_idx']:tile_info['xf_idx']]
-            data = scipy.ndimage.zoom(data, img_info['scale'], order=0)
+            # Color images are not zoomed along their channel axis
+            zoom = (img_info['scale'], img_info['scale'])+(1,)*(data.ndim-2)
+            data = scipy.ndimage.zoom(data, zoom, order=0)
         except ImportError:
             if img_info['scale']>1:
                 data = data[tile_info['y0_idx']:tile_info['yf_idx'],
                     tile_info['x0_idx']:tile_info['xf_idx']]
-                data = np.kron(data, np.ones((img_info['scale'],img_info['scale'])))
+                data = np.kron(data, np.ones(
+                    (img_info['scale'],img_info['scale'])+(1,)*(data.ndim-2)))
                 #data = zoom(data, img_info['scale'], order=0)
             elif img_info['scale']<1 and img_info['scale']>0:
                 tile_width = min(file_info['tile_width'],
@@ -339,84 +638,434 @@ def scale_data(file_info, img_info, tile_info, data):
                 raise ToyzJobError('Scale must be a positive number')
     return data
 
-def create_tile(file_info, img_info, tile_info):
+def block_reduce(data, factor, mode):
+    """
+    Downsample an array by combining each ``factor`` x ``factor`` block of pixels into
+    a single pixel. The blocks are reduced in a single vectorized operation by reshaping
+    the array so that the rows and columns of each block lie along their own axes.
+    Blocks where every pixel is NaN are NaN.
+    
+    Parameters
+        - data (*numpy array* ): 2D array to downsample
+        - factor (*int* ): Size of the blocks
+        - mode (*string* ): One of the ``block_reduce_modes`` (``'MEAN'``, ``'MEDIAN'``,
+          ``'MAX'`` or ``'SUM'``)
+    
+    Returns
+        - data (*numpy array* ): Array with shape ``ceil(data.shape/factor)``
+    """
+    height, width = data.shape
+    pad_y = -height % factor
+    pad_x = -width % factor
+    # Partial blocks at the edge of the image are padded: with zeros when summing, 
+    # otherwise with their edge pixels so they do not change the result
+    if pad_x>0 or pad_y>0:
+        if mode=='SUM':
+            data = np.pad(data, ((0,pad_y),(0,pad_x)), mode='constant')
+        else:
+            data = np.pad(data, ((0,pad_y),(0,pad_x)), mode='edge')
+        height, width = data.shape
+    blocks = data.reshape(height//factor, factor, width//factor, factor)
+    with warnings.catch_warnings():
+        # Blocks of NaN pixels are expected (for example the edges of a mosaic)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return block_reduce_modes[mode](blocks, axis=(1,3))
+
+def resample_nearest(data, width, height):
+    """
+    Resample an array to ``width`` x ``height`` using the nearest pixel.
+    """
+    if data.shape==(height, width):
+        return data
+    x_idx = (np.arange(width)*(data.shape[1]/width)).astype(int)
+    y_idx = (np.arange(height)*(data.shape[0]/height)).astype(int)
+    return data[y_idx[:,np.newaxis], x_idx]
+
+def bin_data(file_info, img_info, tile_info):
+    """
+    Create the data for a tile using one of the ``block_reduce_modes`` . The data is read
+    from a pyramid built with the same mode (see :py:func:`toyz.web.viewer.get_pyramid` ),
+    using the level below the one that would be used for the current scale, so the data
+    only needs to be binned by the remaining factor of 2 or 3. The nearest pixel is used
+    for the remaining (less than 1.5x) scale factor. Unlike ``NEAREST`` resampling every
+    pixel contributes to the tile, so sparse bright sources are not lost when zoomed out.
+    """
+    if img_info['scale']<=0:
+        raise ToyzJobError('Scale must be a positive number')
+    level = max(0, get_pyramid_level(img_info['scale'])-1)
+    level, data = get_pyramid(file_info, img_info, level, file_info['resampling'])
+    height, width = data.shape
+    level_img_info, level_tile_info = get_level_info(
+        img_info, tile_info, level, width, height)
+    data = data[level_tile_info['y0_idx']:level_tile_info['yf_idx'],
+        level_tile_info['x0_idx']:level_tile_info['xf_idx']]
+    # Add a small tolerance so that exact fractions are not lost to rounding errors
+    factor = int(1/level_img_info['scale']+1e-9)
+    if factor>1:
+        data = block_reduce(data, factor, file_info['resampling'])
+    return resample_nearest(data, tile_info['width'], tile_info['height'])
+
+def encode_tile(img, tile_format):
+    """
+    Encode a PIL image in memory using one of the ``img_formats`` .
+    """
+    from io import BytesIO
+    tile_buffer = BytesIO()
+    img.save(tile_buffer, format=img_formats[tile_format])
+    return tile_buffer.getvalue()
+
+def load_cached_tile(file_info, img_info, tile_info, tile_cache):
+    """
+    Load a tile from the ``tile_cache`` (see :py:func:`toyz.web.tile_cache.get_tile_cache` ).
+    If ``file_info['tile_transport']`` is ``'websocket'`` the encoded tile is loaded into
+    ``tile_info['tile_data']`` , otherwise it is linked to ``tile_info['new_filepath']`` .
+    Returns **True** if the tile was found in the cache.
+    """
+    if tile_cache is None:
+        return False
+    tile_key = cache_utils.get_tile_key(file_info, img_info, tile_info)
+    cache_filepath = cache_utils.load_tile(tile_cache, tile_key, file_info['tile_format'])
+    if cache_filepath is None:
+        return False
     try:
-        from PIL import Image
-    except ImportError:
-        raise ToyzJobError(
-            "You must have PIL (Python Imaging Library) installed to "
-            "open files of this type"
-        )
+        if file_info.get('tile_transport', 'file') == 'websocket':
+            tile_info['tile_data'] = cache_utils.read_tile(cache_filepath)
+        else:
+            cache_utils.link_tile(cache_filepath, tile_info['new_filepath'])
+    except (IOError, OSError):
+        # Another process removed the tile from the cache, so it must be recreated
+        return False
+    return True
+
+def get_tile_data(file_info, img_info, tile_info):
+    """
+    Read the part of the image needed for a tile from the image pyramid (see
+    :py:func:`toyz.web.viewer.get_pyramid` ). This is the only step of creating a tile
+    that opens the image, so it is run in the session process that stores the pyramids
+    and the rest of the tile can be rendered anywhere
+    (see :py:func:`toyz.web.viewer.render_tile` ).
     
+    Returns
+        - data (*numpy array* or *PIL Image* ): For FITS images the (flipped) data for the
+          tile, before the colormap is applied. For other images the cropped image.
+    """
+    binned = file_info['resampling'] in block_reduce_modes
     if file_info['ext']=='fits':
-        try:
-            from matplotlib import cm as cmap
-            from matplotlib.colors import Normalize, LinearSegmentedColormap
-        except ImportError:
-            raise ToyzJobError("You must have matplotlib installed to load FITS images")
-        
-        hdulist = get_file(file_info)
-        data = hdulist[int(img_info['frame'])].data
-        # If no advanced resampling algorithm is used, scale the data as quickly as possible.
-        # Otherwise crop the data.
-        if file_info['resampling'] == 'NEAREST':
-            data = scale_data(file_info, img_info, tile_info, data)
+        if binned:
+            data = bin_data(file_info, img_info, tile_info)
         else:
-            data = data[
-                tile_info['y0_idx']:tile_info['yf_idx'],
-                tile_info['x0_idx']:tile_info['xf_idx']]
+            # Read the data from the smallest level of the image pyramid that still has
+            # enough resolution for the current scale
+            if 'pyramid_level' in tile_info:
+                level = tile_info['pyramid_level']
+            else:
+                level = get_pyramid_level(img_info['scale'])
+            level, data = get_pyramid(file_info, img_info, level,
+                get_pyramid_mode(file_info['resampling']))
+            height, width = data.shape
+            level_img_info, level_tile_info = get_level_info(
+                img_info, tile_info, level, width, height)
+            # If no advanced resampling algorithm is used, scale the data as quickly as
+            # possible. Otherwise crop the data.
+            if file_info['resampling'] == 'NEAREST':
+                data = scale_data(file_info, level_img_info, level_tile_info, data)
+            else:
+                data = data[
+                    level_tile_info['y0_idx']:level_tile_info['yf_idx'],
+                    level_tile_info['x0_idx']:level_tile_info['xf_idx']]
         # FITS images have a flipped y-axis from what browsers and other image formats expect
         if img_info['invert_y']:
             data = np.flipud(data)
         if img_info['invert_x']:
             data = np.fliplr(data)
-        
-        norm = Normalize(img_info['colormap']['px_min'], img_info['colormap']['px_max'], True)
-        colormap_name = img_info['colormap']['name']
-        if img_info['colormap']['invert_color']:
-            colormap_name = colormap_name + '_r'
-        colormap = getattr(cmap, colormap_name)
-        cm = cmap.ScalarMappable(norm, colormap)
-        img = np.uint8(cm.to_rgba(data)*255)
+        # Copy the tile out of the pyramid, so that only the tile is sent to other processes
+        return np.ascontiguousarray(data)
+    
+    if binned:
+        # PIL images are not binned, the closest filter is a box filter (the mean)
+        # on the full resolution image
+        level = 0
+    elif 'pyramid_level' in tile_info:
+        level = tile_info['pyramid_level']
+    else:
+        level = get_pyramid_level(img_info['scale'])
+    level, img = get_pyramid(file_info, img_info, level,
+        get_pyramid_mode(file_info['resampling']))
+    width, height = img.size
+    level_img_info, level_tile_info = get_level_info(
+        img_info, tile_info, level, width, height)
+    return img.crop((
+        level_tile_info['x0_idx'], level_tile_info['y0_idx'], 
+        level_tile_info['xf_idx'], 
+        level_tile_info['yf_idx']))
+
+def render_tile(file_info, img_info, tile_info, data, tile_cache=None):
+    """
+    Apply the colormap to the data for a tile (see :py:func:`toyz.web.viewer.get_tile_data` ),
+    resize it and encode it. If ``file_info['tile_transport']`` is ``'websocket'`` the
+    encoded tile is returned in ``tile_info['tile_data']`` so that it can be sent directly
+    to the client, otherwise it is saved to ``tile_info['new_filepath']`` . If a
+    ``tile_cache`` is given the new tile is added to it.
+    """
+    from PIL import Image
+    
+    binned = file_info['resampling'] in block_reduce_modes
+    if file_info['ext']=='fits':
+        img = colormaps.apply_colormap(data, img_info['colormap'])
         img = Image.fromarray(img)
-        if file_info['resampling'] != 'NEAREST':
+        if file_info['resampling'] != 'NEAREST' and not binned:
             img = img.resize(
                 (tile_info['width'], tile_info['height']), 
                 getattr(Image, file_info['resampling']))
     else:
-        img = get_file(file_info)
-        img = img.crop((
-            tile_info['x0_idx'], tile_info['y0_idx'], 
-            tile_info['xf_idx'], 
-            tile_info['yf_idx']))
-        img = img.resize(
-            (tile_info['width'], tile_info['height']), getattr(Image, file_info['resampling']))
+        if binned:
+            resampling = getattr(Image, 'BOX', Image.NEAREST)
+        else:
+            resampling = getattr(Image, file_info['resampling'])
+        img = data.resize((tile_info['width'], tile_info['height']), resampling)
     width, height = img.size
-    if width>0 and height>0:
+    if width==0 or height==0:
+        return False, ''
+    in_memory = file_info.get('tile_transport', 'file') == 'websocket'
+    if in_memory or tile_cache is not None:
+        tile_data = encode_tile(img, file_info['tile_format'])
+    if tile_cache is not None:
+        tile_key = cache_utils.get_tile_key(file_info, img_info, tile_info)
+        cache_filepath = cache_utils.save_tile(
+            tile_cache, tile_key, tile_data, file_info['tile_format'])
+    if in_memory:
+        tile_info['tile_data'] = tile_data
+    elif tile_cache is not None:
+        cache_utils.link_tile(cache_filepath, tile_info['new_filepath'])
+    else:
         path = os.path.dirname(tile_info['new_filepath'])
         core.create_paths([path])
         img.save(tile_info['new_filepath'], format=img_formats[file_info['tile_format']])
-    else:
-        return False, ''
     return True, tile_info
 
-def get_img_data(data_type, file_info, img_info, **kwargs):
+def create_tile(file_info, img_info, tile_info, tile_cache=None):
+    """
+    Create a tile. If ``file_info['tile_transport']`` is ``'websocket'`` the encoded tile
+    is returned in ``tile_info['tile_data']`` so that it can be sent directly to the
+    client, otherwise it is saved to ``tile_info['new_filepath']`` . If a ``tile_cache``
+    is given (see :py:func:`toyz.web.tile_cache.get_tile_cache` ) the tile is loaded from
+    the cache if it has already been created, otherwise the new tile is added to it.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ToyzJobError(
+            "You must have PIL (Python Imaging Library) installed to "
+            "open files of this type"
+        )
+    
+    if load_cached_tile(file_info, img_info, tile_info, tile_cache):
+        return True, tile_info
+    data = get_tile_data(file_info, img_info, tile_info)
+    return render_tile(file_info, img_info, tile_info, data, tile_cache)
+
+def create_tile_worker(args):
+    """
+    Create a tile (see :py:func:`toyz.web.viewer.create_tiles` ). Errors are returned
+    instead of raised so that a single bad tile does not stop the rest of the tiles
+    from loading.
+    
+    Parameters
+        - args (*tuple* ): ``(file_info, img_info, tile_info, tile_cache)`` for the tile
+    
+    Returns
+        - tile_idx (*string* ): Index of the tile
+        - created (*bool* ): Whether or not the tile was created
+        - tile_info (*dict* ): Info for the new tile
+        - error (*string* ): Traceback of the error if the tile could not be created,
+          otherwise **None**
+    """
+    import traceback
+    file_info, img_info, tile_info, tile_cache = args
+    try:
+        created, new_tile_info = create_tile(file_info, img_info, tile_info, tile_cache)
+    except Exception:
+        return tile_info['idx'], False, tile_info, traceback.format_exc()
+    return tile_info['idx'], created, new_tile_info, None
+
+def render_tile_worker(args):
+    """
+    Render a tile in a worker process of the process pool shared by all sessions (see
+    :py:func:`toyz.web.viewer.create_tiles` ). The worker only receives the data for
+    the tile, so it never opens the image or builds its own pyramid.
+    
+    Parameters
+        - args (*tuple* ): ``(file_info, img_info, tile_info, data, tile_cache)`` for the
+          tile, where ``data`` was loaded by :py:func:`toyz.web.viewer.get_tile_data`
+    
+    Returns
+        The same result as :py:func:`toyz.web.viewer.create_tile_worker`
+    """
+    import traceback
+    file_info, img_info, tile_info, data, tile_cache = args
+    try:
+        created, new_tile_info = render_tile(file_info, img_info, tile_info, data, tile_cache)
+    except Exception:
+        return tile_info['idx'], False, tile_info, traceback.format_exc()
+    return tile_info['idx'], created, new_tile_info, None
+
+def create_tiles(file_info, img_info, tiles, tile_cache=None, processes=None):
+    """
+    Create a batch of tiles in parallel, using the process pool shared by all sessions
+    (see :py:func:`toyz.utils.core.run_pool_task` ). The data for each tile is read from
+    the image pyramid in this process (see :py:func:`toyz.web.viewer.get_tile_data` )
+    and only the colormap, resizing and encoding are done in the pool
+    (see :py:func:`toyz.web.viewer.render_tile_worker` ). Tiles are created in order of their
+    ``priority`` (see :py:func:`toyz.web.viewer.get_tile_info` ) and at most ``processes``
+    tiles are sent to the pool at a time, so tiles that are no longer in the viewport
+    when their turn comes (see :py:func:`toyz.web.viewer.tile_in_viewport` ) are skipped.
+    
+    Parameters
+        - file_info (*dict* ): File information for the image
+        - img_info (*dict* ): Information about the image frame
+        - tiles (*dict* ): Dictionary of ``tile_idx: tile_info`` for each tile to create
+          (for example the ``new_tiles`` returned by :py:func:`toyz.web.viewer.get_tile_info` )
+        - tile_cache (*dict*, optional): Tile cache used to store the tiles
+        - processes (*int*, optional): Number of tiles created at the same time (by default
+          one for each cpu on the server). If this is ``1``, or the tiles are not created 
+          in a session process, the tiles are created one at a time in this process.
+    
+    Returns
+        An iterator that yields the result of 
+        :py:func:`toyz.web.viewer.create_tile_worker` for each tile as soon as it has
+        been created (not necessarily in the same order as ``tiles`` ). Skipped tiles
+        are yielded as not created, with no error.
+    """
+    import multiprocessing
+    import traceback
+    pending = sorted(tiles.values(), key=lambda tile_info: tile_info.get('priority', 0))
+    
+    # There is no need to send a single tile to another process
+    if len(pending)<2 or processes==1 or not session_vars.session_process:
+        for tile_info in pending:
+            if tile_in_viewport(file_info, img_info, tile_info):
+                yield create_tile_worker((file_info, img_info, tile_info, tile_cache))
+            else:
+                yield tile_info['idx'], False, tile_info, None
+        return
+    
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # Tiles sent to the pool, with keys task_id
+    running = {}
+    try:
+        while len(pending)>0 or len(running)>0:
+            while len(pending)>0 and len(running)<processes:
+                tile_info = pending.pop(0)
+                if not tile_in_viewport(file_info, img_info, tile_info):
+                    yield tile_info['idx'], False, tile_info, None
+                    continue
+                # Cached tiles and the data for new tiles are loaded in this process,
+                # which keeps the image pyramids, so the pool only renders the tiles
+                try:
+                    if load_cached_tile(file_info, img_info, tile_info, tile_cache):
+                        yield tile_info['idx'], True, tile_info, None
+                        continue
+                    data = get_tile_data(file_info, img_info, tile_info)
+                except Exception:
+                    yield tile_info['idx'], False, tile_info, traceback.format_exc()
+                    continue
+                task_id = core.run_pool_task(render_tile_worker, 
+                    ((file_info, img_info, tile_info, data, tile_cache),))
+                running[task_id] = tile_info
+            if len(running)>0:
+                results = core.get_pool_results(list(running.keys()))
+                for task_id, (result, error) in results.items():
+                    tile_info = running.pop(task_id)
+                    if error is not None:
+                        yield tile_info['idx'], False, tile_info, error
+                    else:
+                        yield result
+    finally:
+        # If the job stopped early (for example it was cancelled) any tiles still being
+        # created are ignored
+        core.cancel_pool_tasks(list(running.keys()))
+
+# Data types that can be read as javascript typed arrays. Other types are converted to
+# float64 before they are sent to the client.
+typed_array_dtypes = ['int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 
+    'float32', 'float64']
+
+def encode_array(data, dtype=None):
     """
-    Get data from an image or FITS file
+    Encode an array as a little-endian buffer that the client can read as a typed array.
+    
+    Parameters
+        - data (*numpy array* ): 2D array to encode, or a 3D array with the channels of a
+          color image as its last axis (see :py:func:`toyz.web.viewer.get_frame_data` )
+        - dtype (*string*, optional): Data type to convert the array to before it is 
+          encoded (for example ``'float32'`` to halve the size of float64 data)
+    
+    Returns
+        - array_info (*dict* ): ``shape`` and ``dtype`` of the encoded array
+        - buffer (*bytes* ): The array data in C order
+    """
+    if data.ndim not in [2,3]:
+        raise ToyzJobError(
+            "Only 2D arrays and color images can be encoded, received an array with "
+            "shape {0}".format(data.shape))
+    if dtype is None:
+        dtype = data.dtype.name
+        if data.dtype.kind=='b':
+            dtype = 'uint8'
+        elif dtype not in typed_array_dtypes:
+            dtype = 'float64'
+    elif dtype not in typed_array_dtypes:
+        raise ToyzJobError("Unsupported data type '{0}'".format(dtype))
+    data = np.ascontiguousarray(data, dtype=np.dtype(dtype).newbyteorder('<'))
+    array_info = {
+        'shape': list(data.shape),
+        'dtype': dtype
+    }
+    return array_info, data.tobytes()
+
+def get_frame_data(file_info, img_info, luminance=False):
+    """
+    Get the data for an image frame (for non-FITS images the image converted to an array).
+    Color images have a trailing axis for their channels, unless ``luminance=True`` , in
+    which case the luminance of the image is used.
     """
     if file_info['ext']=='fits':
         hdulist = get_file(file_info)
-        data = hdulist[int(img_info['frame'])].data
-    else:
-        try:
-            from PIL import Image
-        except ImportError:
-            raise ToyzJobError(
-                "You must have PIL (Python Imaging Library) installed to "
-                "open files of this type"
-            )
-        img = get_file(file_info)
-        data = np.array(img)
+        return hdulist[int(img_info['frame'])].data
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ToyzJobError(
+            "You must have PIL (Python Imaging Library) installed to "
+            "open files of this type"
+        )
+    img = get_file(file_info)
+    data = np.array(img)
+    if luminance and data.ndim==3:
+        data = np.array(img.convert('L'))
+    return data
+
+def get_img_histogram(file_info, img_info, **kwargs):
+    """
+    Get the histogram of an image frame (see :py:func:`toyz.web.region_stats.get_histogram`
+    for the keyword arguments).
+    """
+    data = get_frame_data(file_info, img_info, luminance=True)
+    histogram = region_stats.get_histogram(file_info, img_info, data, **kwargs)
+    response = {
+        'id': 'histogram'
+    }
+    response.update(histogram)
+    return response
+
+def get_img_data(data_type, file_info, img_info, **kwargs):
+    """
+    Get data from an image or FITS file. If ``binary=True`` is passed with 
+    ``data_type='data'`` the data is sent as a binary message instead of a list (see
+    :py:func:`toyz.web.viewer.encode_array` ), optionally converted to ``dtype`` .
+    """
+    data = get_frame_data(file_info, img_info)
     
     if data_type == 'data':
         if 'scale' in kwargs:
@@ -429,6 +1078,9 @@ def get_img_data(data_type, file_info, img_info, **kwargs):
         y0 = max(0, kwargs['y']-height)
         xf = min(data.shape[1], kwargs['x']+width)
         yf = min(data.shape[0], kwargs['y']+height)
+        # Statistics are calculated from the full resolution region
+        response = region_stats.get_region_stats(file_info, img_info, data, x0, y0, xf, yf)
+        response['id'] = 'data'
         if 'scale' in kwargs:
             tile_data = {
                 'x0_idx': x0,
@@ -439,21 +1091,19 @@ def get_img_data(data_type, file_info, img_info, **kwargs):
             data = scale_data(file_info, img_info, tile_data, data)
         else:
             data = data[y0:yf, x0:xf]
-        response = {
-            'id': 'data',
-            'min': float(data.min()),
-            'max': float(data.max()),
-            'mean': float(data.mean()),
-            'median': float(np.median(data)),
-            'std_dev': float(np.std(data)),
-            'data': data.tolist()
-        }
+        if kwargs.get('binary', False):
+            array_info, response['binary'] = encode_array(data, kwargs.get('dtype'))
+            response.update(array_info)
+        else:
+            response['data'] = data.tolist()
     elif data_type == 'datapoint':
         if (kwargs['x']<data.shape[1] and kwargs['y']<data.shape[0] and
                 kwargs['x']>=0 and kwargs['y']>=0):
+            px_value = data[kwargs['y'],kwargs['x']]
             response = {
                 'id': 'datapoint',
-                'px_value': float(data[kwargs['y'],kwargs['x']])
+                # Color images have a value for each channel
+                'px_value': px_value.tolist() if data.ndim==3 else float(px_value)
             }
         else:
             response = {